@@ -0,0 +1,237 @@
+import io
+
+from PIL import Image
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from image_utils import attach_encoded
+from pdf_generator import PDFGenerator
+
+
+class LazyImages:
+    """Ilustracje trzymane jako bajty — obraz PIL powstaje dopiero przy rysowaniu i zaraz znika"""
+
+    def __init__(self, encoded):
+        self._encoded = list(encoded or [])
+
+    def __len__(self):
+        return len(self._encoded)
+
+    def __getitem__(self, idx):
+        data = self._encoded[idx]
+        # Image.open czyta tylko nagłówek; piksele dekoduje dopiero pomniejszanie
+        image = Image.open(io.BytesIO(data))
+        return attach_encoded(image, data, image.format or "JPEG")
+
+
+# -----------------------------
+# ZAPIS PDF CZĘŚĆ PO CZĘŚCI
+# -----------------------------
+class StreamingPDFWriter:
+    """
+    Składa jeden PDF z kolejnych części (gotowych PDF z ReportLab) i od razu zapisuje
+    ich obiekty do strumienia wyjściowego. W pamięci zostają tylko przesunięcia obiektów,
+    numery stron i zakładki — nie treść stron ani obrazy.
+    """
+
+    # Obiekty zapisywane na końcu, ale z numerami zarezerwowanymi od początku
+    CATALOG = 1
+    PAGES = 2
+    OUTLINES = 3
+    INFO = 4
+
+    def __init__(self, output):
+        self._file = open(output, "wb") if isinstance(output, str) else output
+        self._owns_file = isinstance(output, str)
+        self._position = 0
+        self._offsets = {}
+        self._next_number = 5
+        self._pages = []
+        self._outline = []
+
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self._pages)
+
+    def add_part(self, data):
+        """Dopisuje wszystkie strony części (bajty PDF); obiekty części nie są współdzielone z innymi"""
+        reader = PdfReader(io.BytesIO(data))
+        numbers = {}
+        pending = []
+
+        for page in reader.pages:
+            page_ref = self._reference(page.indirect_reference, numbers, pending)
+            self._pages.append(page_ref.idnum)
+
+        while pending:
+            number, obj = pending.pop()
+            if obj.get("/Type") == "/Page":
+                # Strona trafia do wspólnego drzewa stron dokumentu
+                obj[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+            self._write_object(number, self._remap(obj, numbers, pending))
+
+    def add_bookmark(self, title, page_index):
+        """Zakładka najwyższego poziomu do strony o danym indeksie (od 0)"""
+        self._outline.append((title, page_index))
+
+    def close(self, title=""):
+        """Zapisuje drzewo stron, zakładki, katalog i tablicę xref"""
+        kids = " ".join(f"{number} 0 R" for number in self._pages)
+        self._write_raw(self.PAGES, f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self._pages)} >>")
+        self._write_outline()
+        self._write_raw(self.INFO, f"<< /Title {_pdf_string(title)} /Producer (Fabryka Opowiadan) >>")
+        self._write_raw(
+            self.CATALOG,
+            f"<< /Type /Catalog /Pages {self.PAGES} 0 R /Outlines {self.OUTLINES} 0 R /PageMode /UseOutlines >>"
+        )
+
+        xref = self._position
+        lines = [f"xref\n0 {self._next_number}\n", "0000000000 65535 f \n"]
+        lines += [f"{self._offsets[number]:010d} 00000 n \n" for number in range(1, self._next_number)]
+        lines.append(
+            f"trailer\n<< /Size {self._next_number} /Root {self.CATALOG} 0 R /Info {self.INFO} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n"
+        )
+        self._write("".join(lines).encode("latin-1"))
+
+        if self._owns_file:
+            self._file.close()
+
+    def _write_outline(self):
+        first = self._next_number
+        self._next_number += len(self._outline)
+        for idx, (title, page_index) in enumerate(self._outline):
+            number = first + idx
+            links = f"/Prev {number - 1} 0 R " if idx else ""
+            if idx < len(self._outline) - 1:
+                links += f"/Next {number + 1} 0 R "
+            self._write_raw(
+                number,
+                f"<< /Title {_pdf_string(title)} /Parent {self.OUTLINES} 0 R {links}"
+                f"/Dest [ {self._pages[page_index]} 0 R /Fit ] >>"
+            )
+
+        if self._outline:
+            self._write_raw(
+                self.OUTLINES,
+                f"<< /Type /Outlines /First {first} 0 R /Last {first + len(self._outline) - 1} 0 R "
+                f"/Count {len(self._outline)} >>"
+            )
+        else:
+            self._write_raw(self.OUTLINES, "<< /Type /Outlines /Count 0 >>")
+
+    def _reference(self, ref, numbers, pending):
+        """Nowy numer obiektu części (przy pierwszym użyciu obiekt trafia do kolejki zapisu)"""
+        if ref.idnum not in numbers:
+            numbers[ref.idnum] = self._next_number
+            self._next_number += 1
+            pending.append((numbers[ref.idnum], ref.get_object()))
+        return IndirectObject(numbers[ref.idnum], 0, None)
+
+    def _remap(self, obj, numbers, pending):
+        # Obiekty części należą tylko do tego zapisu — odwołania podmieniamy w miejscu
+        if isinstance(obj, IndirectObject):
+            return self._reference(obj, numbers, pending)
+        if isinstance(obj, DictionaryObject):
+            for key, value in list(obj.items()):
+                if key == "/Parent" and obj.get("/Type") == "/Page":
+                    continue
+                obj[key] = self._remap(value, numbers, pending)
+        elif isinstance(obj, ArrayObject):
+            for idx, value in enumerate(obj):
+                obj[idx] = self._remap(value, numbers, pending)
+        return obj
+
+    def _write_object(self, number, obj):
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer)
+        self._offsets[number] = self._position
+        self._write(f"{number} 0 obj\n".encode() + buffer.getvalue() + b"\nendobj\n")
+
+    def _write_raw(self, number, body):
+        self._offsets[number] = self._position
+        self._write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def _write(self, data):
+        self._file.write(data)
+        self._position += len(data)
+
+
+def _pdf_string(text):
+    """Tekst PDF w UTF-16BE (polskie znaki w tytułach zakładek)"""
+    return "<FEFF" + text.encode("utf-16-be").hex().upper() + ">"
+
+
+# -----------------------------
+# ANTOLOGIA
+# -----------------------------
+class AnthologyBuilder:
+    """
+    Antologia wielu opowiadań w jednym PDF, składana opowiadanie po opowiadaniu.
+
+    Rekordy (słowniki: text, title, author, images — lista zakodowanych bajtów obrazów)
+    są pobierane z iteratora pojedynczo. Każde opowiadanie jest składane jako osobna część
+    PDF i od razu dopisywane do pliku wyjściowego (StreamingPDFWriter), więc pamięć
+    zależy od największego opowiadania, a nie od liczby opowiadań; z poprzednich zostają
+    tylko pozycje spisu treści. Każda część osadza własny podzbiór czcionki (ok. 35 KB).
+    Spis treści jest na końcu (numery stron znane dopiero po złożeniu), a nawigację
+    zapewniają zakładki PDF.
+    """
+
+    def __init__(self, generator=None, profile="screen"):
+        self.generator = generator or PDFGenerator(profile=profile)
+
+    def build(self, stories, output, title="Antologia", author="", on_story=None):
+        """
+        Zapisuje antologię do output (ścieżka albo strumień binarny).
+        on_story(numer, rekord, pierwsza_strona) — po złożeniu każdego opowiadania.
+        Zwraca słownik: stories, pages, toc.
+        """
+        gen = self.generator
+        writer = StreamingPDFWriter(output)
+
+        # Strona tytułowa antologii (bez numeru)
+        writer.add_part(self._render_part(lambda c: gen.start_document(c, title, author)))
+
+        toc = []
+        page = 1
+        for number, story in enumerate(stories, start=1):
+            story_title = story.get("title") or f"Opowiadanie {number}"
+            story_author = story.get("author", "")
+            first_page = page
+            record = {
+                "text": story["text"],
+                "title": story_title,
+                "author": story_author,
+                "images": LazyImages(story.get("images")),
+            }
+
+            def draw(c):
+                gen.start_document(c)
+                gen.draw_story(c, record, first_page)
+
+            writer.add_bookmark(story_title, writer.page_count)
+            writer.add_part(self._render_part(draw))
+            page = writer.page_count
+
+            label = f"{story_title} — {story_author}" if story_author else story_title
+            toc.append({"label": label, "page": first_page})
+            if on_story:
+                on_story(number, story, first_page)
+
+        writer.add_bookmark("Spis treści", writer.page_count)
+        writer.add_part(self._render_part(lambda c: gen.draw_toc(c, toc)))
+        writer.close(title)
+        return {"stories": len(toc), "pages": page - 1, "toc": toc}
+
+    def _render_part(self, draw):
+        """Bajty osobnego PDF z tym, co narysuje draw(c)"""
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+        draw(c)
+        c.save()
+        return buffer.getvalue()
@@ -1,6 +1,12 @@
 import streamlit as st
 import openai
-from story_generator import StoryGenerator
+from openai_client import get_client, close_client
+from cache import get_completion_cache, get_image_cache
+from scheduler import get_scheduler
+from font_registry import get_font_registry
+from story_generator import StoryGenerator, DRAFT_QUALITY
+from pipeline import StoryPipeline
+from title_layers import compose_title
 from pdf_generator import PDFGenerator
 from ebook_generator import EbookGenerator
 import os
@@ -42,6 +48,14 @@ if 'author_name' not in st.session_state:
     st.session_state.author_name = "Anna Wilga"
 if 'custom_title_input' not in st.session_state:
     st.session_state.custom_title_input = ""
+if 'last_modification_diff' not in st.session_state:
+    st.session_state.last_modification_diff = ""
+if 'cover_title' not in st.session_state:
+    st.session_state.cover_title = ""
+if 'cover_variants' not in st.session_state:
+    st.session_state.cover_variants = []
+if 'illustration_variants' not in st.session_state:
+    st.session_state.illustration_variants = []
 
 # CSS
 st.markdown("""
@@ -89,13 +103,17 @@ with st.sidebar:
     if st.button("🔗 Połącz z API"):
         if api_key_input:
             try:
-                openai.api_key = api_key_input
-                client = openai.OpenAI(api_key=api_key_input)
+                # Współdzielony klient — kolejne akcje używają tej samej puli połączeń
+                client = get_client(api_key_input)
                 client.models.list()
                 st.session_state.api_key = api_key_input
                 st.session_state.api_connected = True
                 st.success("✅ Połączono z OpenAI API!")
             except Exception as e:
+                # Zamykamy klienta tylko dla błędnego klucza — przy chwilowym błędzie sieci
+                # ten sam klient może właśnie obsługiwać zapytania innych sesji
+                if isinstance(e, openai.AuthenticationError):
+                    close_client(api_key_input)
                 st.error(f"❌ Błąd połączenia: {str(e)}")
                 st.session_state.api_connected = False
         else:
@@ -103,6 +121,14 @@ with st.sidebar:
     
     if st.session_state.api_connected:
         st.markdown('<div class="success-box">✅ API Połączone</div>', unsafe_allow_html=True)
+
+        with st.expander("📊 Kolejka zapytań do API"):
+            for endpoint, m in get_scheduler(st.session_state.api_key).metrics().items():
+                st.caption(
+                    f"**{endpoint}** — w kolejce: {m['queue_depth']} · w toku: {m['in_flight']}/{m['limit']} · "
+                    f"zapytania: {m['requests']} · ponowienia: {m['retries']} · "
+                    f"śr. oczekiwanie: {m['avg_wait']:.2f}s (maks. {m['max_wait']:.2f}s)"
+                )
     
     st.divider()
     
@@ -114,6 +140,12 @@ with st.sidebar:
         index=0
     )
     
+    structured_output = st.checkbox(
+        "⚡ Tytuły i sceny w jednym zapytaniu",
+        value=True,
+        help="Model zwraca opowiadanie razem z tytułami, scenami do ilustracji i opisem okładki"
+    )
+    
     # Długość opowiadania
     st.subheader("📏 Długość opowiadania")
     word_count = st.selectbox(
@@ -121,10 +153,101 @@ with st.sidebar:
         [1500, 2000, 2500, 3000, 3500],
         index=1
     )
+    long_form = word_count >= 3000 and st.checkbox(
+        "🧩 Długa forma (plan + równoległe części)",
+        value=True,
+        help="Najpierw plan ze stałą obsadą, potem wszystkie części pisane jednocześnie"
+    )
     
+    # Szkice ilustracji
+    draft_images = st.checkbox(
+        "✏️ Szybkie szkice ilustracji",
+        value=True,
+        help="Podglądy w niskiej jakości; wybrane ilustracje i okładka są renderowane w pełnej jakości przy eksporcie"
+    )
+
+    # Zapasowe zapytanie przy wolnej odpowiedzi API obrazów
+    hedge_images = st.checkbox(
+        "⏱️ Zapasowe zapytania o obrazy",
+        value=False,
+        help="Gdy obraz generuje się dłużej niż zwykle, równolegle startuje drugie zapytanie "
+             "z tym samym promptem — wygrywa szybsze (kosztem dodatkowego obrazu)"
+    )
+
+    image_compression = st.slider(
+        "Kompresja obrazów (JPEG)",
+        50, 100, 85, 5,
+        help="Obrazy przychodzą z API jako JPEG o tej kompresji i trafiają do eksportu bez ponownego kodowania"
+    )
+
+    # Pamięć podręczna odpowiedzi
+    st.subheader("♻️ Pamięć podręczna")
+    reuse_responses = st.checkbox(
+        "Używaj zapamiętanych odpowiedzi",
+        value=False,
+        help="Te same parametry i instrukcje zwrócą zapisany wynik zamiast nowego zapytania do modelu"
+    )
+    for cache_label, shared_cache in [("Tekst", get_completion_cache()), ("Obrazy", get_image_cache())]:
+        if shared_cache is not None:
+            cache_stats = shared_cache.stats()
+            st.caption(
+                f"{cache_label} — trafienia: {cache_stats['hits']} · chybienia: {cache_stats['misses']} · "
+                f"wpisy: {cache_stats['entries']} ({cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+            )
+
+    # Czcionki zastępcze (np. brak pliku w fonts/)
+    for font_variant, font_info in get_font_registry().report().items():
+        if font_info["fallback"]:
+            st.caption(f"⚠️ Czcionka {font_variant}: {font_info['fallback']}")
+
     st.divider()
     st.caption("💡 Wypełnij parametry i wygeneruj opowiadanie!")
 
+def make_generator():
+    """StoryGenerator z bieżącymi ustawieniami z panelu bocznego"""
+    return StoryGenerator(
+        st.session_state.api_key,
+        model,
+        reuse_responses=reuse_responses,
+        draft_images=draft_images,
+        hedge_images=hedge_images,
+        image_compression=image_compression
+    )
+
+
+def finalize_export_images(selected_illustrations):
+    """
+    Szkice wybrane do eksportu i okładkę renderuje w pełnej jakości (tym samym promptem).
+    Wersje finalne zastępują szkice w sesji, więc kolejny eksport nie powtarza pracy.
+    """
+    generator = make_generator()
+    cover_original = st.session_state.cover_image_original
+    drafts = [img for img in selected_illustrations if generator.is_draft(img)]
+    if generator.is_draft(cover_original):
+        drafts.append(cover_original)
+    if not drafts:
+        return selected_illustrations
+
+    with st.spinner("🖌️ Renderuję wybrane ilustracje w pełnej jakości..."):
+        finals = dict(zip(map(id, drafts), generator.finalize_images(drafts)))
+
+    st.session_state.generated_images = [
+        finals.get(id(img), img) for img in st.session_state.generated_images
+    ]
+
+    if id(cover_original) in finals:
+        final_cover = finals[id(cover_original)]
+        st.session_state.cover_image_original = final_cover
+        if st.session_state.cover_title:
+            st.session_state.cover_image = generator.add_title_to_cover(
+                final_cover, st.session_state.cover_title, st.session_state.author_name
+            )
+        else:
+            st.session_state.cover_image = final_cover.copy()
+
+    return [finals.get(id(img), img) for img in selected_illustrations]
+
+
 # Zakładki
 tab1, tab2, tab3 = st.tabs(["📝 Tworzenie", "🎨 Edycja i Export", "👤 O mnie"])
 
@@ -181,8 +304,10 @@ with tab1:
     with col_ill2:
         if include_illustrations:
             num_illustrations = st.number_input("Liczba ilustracji", min_value=1, max_value=10, value=3)
+            illustration_workers = st.slider("Równoległe zapytania o ilustracje", 1, 5, 3)
         else:
             num_illustrations = 0
+            illustration_workers = 1
     
     with col_ill3:
         if include_illustrations:
@@ -207,9 +332,14 @@ with tab1:
         with col_cov2:
             author_name = st.text_input("Autor", value=st.session_state.author_name)
             st.session_state.author_name = author_name
+            cover_variants = st.number_input(
+                "Warianty okładki", min_value=1, max_value=4, value=1,
+                help="Kilka wariantów powstaje w jednym zapytaniu — wybierzesz najlepszy w zakładce Edycja"
+            )
     else:
         cover_sketch = ""
         cover_description = ""
+        cover_variants = 1
         author_name = st.text_input("Autor", value=st.session_state.author_name)
         st.session_state.author_name = author_name
     
@@ -224,7 +354,7 @@ with tab1:
         else:
             with st.spinner("✨ Tworzę opowiadanie..."):
                 try:
-                    generator = StoryGenerator(st.session_state.api_key, model)
+                    generator = make_generator()
                     
                     params = {
                         "age_group": age_group,
@@ -239,24 +369,83 @@ with tab1:
                         "illustration_style": illustration_style,
                         "cover_sketch": cover_sketch,
                         "cover_description": cover_description,
+                        "cover_variants": cover_variants,
                         "author_name": st.session_state.author_name
                     }
                     
-                    story = generator.generate_story(params)
+                    # Tekst pojawia się na bieżąco, w miarę generowania
+                    st.markdown("#### 📖 Twoje opowiadanie")
+                    story_placeholder = st.empty()
+                    story = ""
+                    package = None
+
+                    if long_form:
+                        # Części przychodzą w dowolnej kolejności — pokazujemy ciągły początek
+                        finished_sections = {}
+
+                        def show_section(idx, text, total):
+                            finished_sections[idx] = text
+                            ready = []
+                            while len(ready) in finished_sections:
+                                ready.append(finished_sections[len(ready)])
+                            story_placeholder.markdown(
+                                "\n\n".join(ready)
+                                + f"\n\n*✍️ Gotowe części: {len(finished_sections)}/{total}*"
+                            )
+
+                        story = generator.generate_long_story(params, on_section=show_section)
+                    else:
+                        for fragment in generator.generate_story_stream(params, structured=structured_output):
+                            story += fragment
+                            story_placeholder.markdown(story + "▌")
+
+                        package = generator.story_package if structured_output else None
+                        if package:
+                            story = package["story"]
+                    story_placeholder.markdown(story)
                     st.session_state.story_text = story
                     
-                    st.info("📝 Generuję propozycje tytułów...")
-                    titles = generator.generate_title_suggestions(story)
-                    st.session_state.title_suggestions = titles
-                    
+                    # Tytuły, okładka i ilustracje powstają równolegle
+                    job_labels = {
+                        "titles": "📝 Propozycje tytułów",
+                        "cover": "🎨 Okładka"
+                    }
+                    with st.status("⚙️ Tworzę tytuły, okładkę i ilustracje...", expanded=True) as status:
+                        def report_job(name, result, error):
+                            label = job_labels.get(name, f"🖼️ Ilustracja {int(name.split('_')[-1]) + 1}")
+                            if error is not None:
+                                st.write(f"❌ {label}: {str(error)}")
+                            elif result is None or result == []:
+                                st.write(f"⚠️ {label}: brak wyniku")
+                            else:
+                                st.write(f"✅ {label}")
+
+                        pipeline = StoryPipeline(generator, illustration_workers=illustration_workers)
+                        results = pipeline.run(story, params, on_job_done=report_job, package=package)
+                        status.update(label="✅ Zadania zakończone", state="complete")
+
+                    st.session_state.title_suggestions = results["titles"]
+                    st.session_state.generated_images.extend(results["illustrations"])
+
                     if cover_sketch:
-                        st.info("🎨 Tworzę okładkę...")
-                        cover = generator.generate_cover(cover_sketch, cover_description, illustration_style)
-                        if cover is None:
+                        cover = results["cover"]
+                        variants = cover if isinstance(cover, list) else []
+                        if variants:
+                            # Pierwszy wariant jest okładką do czasu wyboru innego
+                            cover = variants[0]
+                        st.session_state.cover_variants = variants if len(variants) > 1 else []
+                        if cover is None or cover == []:
                             st.error("❌ Nie udało się wygenerować okładki. Spróbuj zmienić opis lub styl.")
                         else:
                             st.session_state.cover_image = cover
                             st.session_state.cover_image_original = cover.copy()
+                            st.session_state.cover_title = ""
+                            # Warstwy z propozycjami tytułów renderują się w tle
+                            generator.prerender_titles(
+                                st.session_state.title_suggestions,
+                                st.session_state.author_name,
+                                cover.size
+                            )
                     
                     st.success("✅ Opowiadanie wygenerowane!")
                     st.rerun()
@@ -270,6 +459,24 @@ with tab1:
 with tab2:
     if st.session_state.story_text:
 
+        # WYBÓR WARIANTU OKŁADKI
+        if st.session_state.cover_variants:
+            st.subheader("🎨 Wybierz wariant okładki")
+            variant_cols = st.columns(len(st.session_state.cover_variants))
+
+            for idx, variant in enumerate(st.session_state.cover_variants):
+                with variant_cols[idx]:
+                    st.image(variant, caption=f"Wariant {idx+1}", width=200)
+                    if st.button(f"✅ Wybierz wariant {idx+1}", key=f"pick_cover_{idx}"):
+                        st.session_state.cover_image = variant
+                        st.session_state.cover_image_original = variant.copy()
+                        st.session_state.cover_title = ""
+                        # Niewybrane warianty nie zostają w pamięci sesji
+                        st.session_state.cover_variants = []
+                        st.rerun()
+
+            st.divider()
+
         # WYBÓR TYTUŁU - POPRAWIONA SEKCJA
         if st.session_state.title_suggestions:
             st.subheader("📖 Wybierz tytuł dla swojego opowiadania")
@@ -330,33 +537,38 @@ with tab2:
                     elif not st.session_state.selected_title:
                         st.error("⚠️ Wybierz lub wpisz tytuł!")
                     else:
-                        with st.spinner("🎨 Nakładam tytuł..."):
-                            try:
-                                generator = StoryGenerator(st.session_state.api_key, model)
-
-                                # KLUCZOWA POPRAWKA: ZAWSZE zaczynamy od czystej okładki
-                                base_cover = st.session_state.cover_image_original.copy()
-
-                                cover_with_title = generator.add_title_to_cover(
-                                    base_cover,
-                                    st.session_state.selected_title,
-                                    st.session_state.author_name
-                                )
-
-                                st.session_state.cover_image = cover_with_title
-                                st.success(f"✅ Tytuł '{st.session_state.selected_title}' dodany do okładki!")
-                                st.rerun()
+                        try:
+                            # ZAWSZE zaczynamy od czystej okładki — warstwa tytułu jest już gotowa
+                            st.session_state.cover_image = compose_title(
+                                st.session_state.cover_image_original,
+                                st.session_state.selected_title,
+                                st.session_state.author_name
+                            )
+                            st.session_state.cover_title = st.session_state.selected_title
+                            st.success(f"✅ Tytuł '{st.session_state.selected_title}' dodany do okładki!")
 
-                            except Exception as e:
-                                st.error(f"❌ Błąd: {str(e)}")
+                        except Exception as e:
+                            st.error(f"❌ Błąd: {str(e)}")
                 
                 # Info jeśli tytuł pusty
                 if not can_apply:
                     st.caption("⚠️ Wybierz lub wpisz tytuł")
             
-            # Podgląd okładki
+            # Podgląd okładki — wybrany tytuł nakładany od razu z gotowej warstwy
             st.divider()
-            if st.session_state.cover_image is not None:
+            preview_title = st.session_state.selected_title
+            if (
+                st.session_state.cover_image_original is not None
+                and preview_title
+                and preview_title != st.session_state.cover_title
+            ):
+                preview = compose_title(
+                    st.session_state.cover_image_original,
+                    preview_title,
+                    st.session_state.author_name
+                )
+                st.image(preview, caption="Podgląd okładki (tytuł jeszcze nie nałożony)", width=300)
+            elif st.session_state.cover_image is not None:
                 st.image(st.session_state.cover_image, caption="Podgląd okładki", width=300)
             else:
                 st.info("ℹ️ Okładka bez tytułu. Wygeneruj okładkę w zakładce 'Tworzenie'.")
@@ -388,16 +600,32 @@ with tab2:
         with col_mod2:
             new_plot = st.text_input("Zmiana fabuły (opcjonalnie)", placeholder="np. dodaj zwrot akcji")
         
+        incremental_edit = st.checkbox(
+            "✂️ Zmieniaj tylko dotknięte akapity",
+            value=True,
+            help="Model przepisuje wyłącznie akapity, których dotyczy zmiana — szybciej przy drobnych poprawkach"
+        )
+        
         if st.button("🎨 Zastosuj zmiany"):
             if new_style or new_plot:
                 with st.spinner("🔄 Modyfikuję opowiadanie..."):
                     try:
-                        generator = StoryGenerator(st.session_state.api_key, model)
-                        modified_story = generator.modify_story(
-                            st.session_state.story_text,
-                            new_style,
-                            new_plot
-                        )
+                        generator = make_generator()
+                        if incremental_edit:
+                            result = generator.modify_story_incremental(
+                                st.session_state.story_text,
+                                new_style,
+                                new_plot
+                            )
+                            modified_story = result["story"]
+                            st.session_state.last_modification_diff = result["diff"]
+                        else:
+                            modified_story = generator.modify_story(
+                                st.session_state.story_text,
+                                new_style,
+                                new_plot
+                            )
+                            st.session_state.last_modification_diff = ""
                         st.session_state.story_text = modified_story
                         st.success("✅ Opowiadanie zmodyfikowane!")
                         st.rerun()
@@ -405,6 +633,10 @@ with tab2:
                         st.error(f"❌ Błąd: {str(e)}")
             else:
                 st.warning("⚠️ Wprowadź przynajmniej jedną zmianę")
+
+        if st.session_state.last_modification_diff:
+            with st.expander("🔍 Co zmieniło się w ostatniej modyfikacji"):
+                st.code(st.session_state.last_modification_diff, language="diff")
         
         st.divider()
 
@@ -415,31 +647,95 @@ with tab2:
             placeholder="Wklej tutaj fragment tekstu..."
         )
         
-        fragment_style = st.selectbox(
-            "Styl ilustracji dla fragmentu",
-            ["Naturalne", "Komiks", "Akwarela", "Pixel Art"],
-            key="fragment_style"
-        )
+        col_frag1, col_frag2 = st.columns([2, 1])
+
+        with col_frag1:
+            fragment_style = st.selectbox(
+                "Styl ilustracji dla fragmentu",
+                ["Naturalne", "Komiks", "Akwarela", "Pixel Art"],
+                key="fragment_style"
+            )
+        with col_frag2:
+            fragment_variants = st.number_input(
+                "Warianty", min_value=1, max_value=4, value=3, key="fragment_variants",
+                help="Wszystkie warianty powstają w jednym zapytaniu"
+            )
         
         if st.button("🎨 Generuj ilustrację dla fragmentu"):
             if selected_fragment:
                 with st.spinner("🎨 Tworzę ilustrację..."):
                     try:
-                        generator = StoryGenerator(st.session_state.api_key, model)
-                        image = generator.generate_illustration(selected_fragment, fragment_style)
-                        if image is None:
+                        generator = make_generator()
+                        result = generator.generate_illustration(
+                            selected_fragment, fragment_style, variants=fragment_variants, fresh=True
+                        )
+                        variants = result if isinstance(result, list) else [result]
+                        variants = [img for img in variants if img is not None]
+                        if not variants:
                             st.error("❌ Nie udało się wygenerować ilustracji. Spróbuj zmienić fragment lub styl.")
-                        else:
-                            st.session_state.generated_images.append(image)
+                        elif len(variants) == 1:
+                            st.session_state.generated_images.append(variants[0])
+                            st.session_state.illustration_variants = []
                             st.success("✅ Ilustracja wygenerowana!")
-                            st.image(image, caption="Nowa ilustracja")
+                            st.image(variants[0], caption="Nowa ilustracja")
+                        else:
+                            st.session_state.illustration_variants = variants
                     except Exception as e:
                         st.error(f"❌ Błąd: {str(e)}")
             else:
                 st.warning("⚠️ Wklej fragment tekstu do zilustrowania")
+
+        # Wybór jednego z wariantów — pozostałe są usuwane z sesji
+        if st.session_state.illustration_variants:
+            st.write("**Wybierz wariant ilustracji:**")
+            variant_cols = st.columns(len(st.session_state.illustration_variants))
+
+            for idx, variant in enumerate(st.session_state.illustration_variants):
+                with variant_cols[idx]:
+                    st.image(variant, caption=f"Wariant {idx+1}", width=200)
+                    if st.button(f"✅ Wybierz wariant {idx+1}", key=f"pick_illustration_{idx}"):
+                        st.session_state.generated_images.append(variant)
+                        st.session_state.illustration_variants = []
+                        st.rerun()
+
+            if st.button("🗑️ Odrzuć wszystkie warianty"):
+                st.session_state.illustration_variants = []
+                st.rerun()
         
         st.divider()
 
+        # AUTOMATYCZNE ILUSTRACJE DLA CAŁEGO OPOWIADANIA
+        st.subheader("🪄 Automatyczne ilustracje")
+        col_auto1, col_auto2, col_auto3 = st.columns(3)
+
+        with col_auto1:
+            auto_count = st.number_input("Liczba scen", min_value=1, max_value=10, value=3, key="auto_count")
+        with col_auto2:
+            auto_style = st.selectbox(
+                "Styl ilustracji",
+                ["Naturalne", "Komiks", "Akwarela", "Pixel Art"],
+                key="auto_style"
+            )
+        with col_auto3:
+            auto_workers = st.slider("Równoległe zapytania", 1, 5, 3, key="auto_workers")
+
+        if st.button("🪄 Zilustruj kluczowe sceny"):
+            with st.spinner("🎨 Tworzę ilustracje kluczowych scen..."):
+                try:
+                    generator = make_generator()
+                    scenes = generator.extract_scenes(st.session_state.story_text, auto_count)
+                    images = generator.generate_illustrations(scenes, auto_style, max_workers=auto_workers)
+                    created = [img for img in images if img is not None]
+                    st.session_state.generated_images.extend(created)
+                    if len(created) < len(scenes):
+                        st.warning(f"⚠️ Wygenerowano {len(created)} z {len(scenes)} ilustracji.")
+                    else:
+                        st.success(f"✅ Wygenerowano {len(created)} ilustracji!")
+                except Exception as e:
+                    st.error(f"❌ Błąd: {str(e)}")
+
+        st.divider()
+
         # WYBÓR ILUSTRACJI DO PDF
         st.subheader("🖼️ Wybierz ilustracje do PDF")
 
@@ -450,7 +746,8 @@ with tab2:
             for idx, img in enumerate(st.session_state.generated_images):
                 with cols[idx % 3]:
                     if img is not None:
-                        st.image(img, caption=f"Ilustracja {idx+1}", width=200)
+                        draft_label = " · szkic" if img.info.get("quality") == DRAFT_QUALITY else ""
+                        st.image(img, caption=f"Ilustracja {idx+1}{draft_label}", width=200)
                         use_it = st.checkbox(f"Użyj ilustracji {idx+1}", key=f"use_img_{idx}")
                         if use_it:
                             selected_illustrations.append(img)
@@ -468,25 +765,51 @@ with tab2:
 
         # --- PDF ---
         with col_exp1:
+            pdf_profile = st.selectbox(
+                "Jakość obrazów w PDF",
+                ["ebook", "screen", "print"],
+                format_func=lambda name: {
+                    "screen": "🖥️ Ekran (najmniejszy plik)",
+                    "ebook": "📱 E-book (150 DPI)",
+                    "print": "🖨️ Druk (300 DPI)"
+                }[name]
+            )
+            pdf_toc = st.checkbox("Spis treści w PDF", value=False)
+            # Układ stron jest zapamiętany — oszacowanie nie łamie tekstu ponownie
+            pdf_pages = PDFGenerator().estimate_pages(
+                st.session_state.story_text,
+                len(selected_illustrations),
+                cover=st.session_state.cover_image is not None,
+                toc=pdf_toc
+            )
+            st.caption(f"📄 Około {pdf_pages} stron")
+
             if st.button("📄 Eksport do PDF", use_container_width=True):
                 try:
-                    pdf_gen = PDFGenerator()
-                    pdf_file = pdf_gen.create_pdf(
+                    selected_illustrations = finalize_export_images(selected_illustrations)
+                    pdf_gen = PDFGenerator(profile=pdf_profile)
+                    pdf_stats = []
+                    pdf_bytes = pdf_gen.create_pdf(
                         st.session_state.story_text,
                         st.session_state.author_name,
                         st.session_state.cover_image,
                         selected_illustrations if selected_illustrations else None,
-                        st.session_state.selected_title  # Przekazujemy tytuł
+                        st.session_state.selected_title,  # Przekazujemy tytuł
+                        toc=pdf_toc,
+                        on_stats=pdf_stats.append
+                    )
+                    st.caption(
+                        f"📄 {pdf_stats[0]['page_count']} stron, "
+                        f"{pdf_stats[0]['file_bytes'] / 1024:.0f} KB"
                     )
                     
-                    with open(pdf_file, "rb") as f:
-                        st.download_button(
-                            label="⬇️ Pobierz PDF",
-                            data=f,
-                            file_name="opowiadanie.pdf",
-                            mime="application/pdf",
-                            use_container_width=True
-                        )
+                    st.download_button(
+                        label="⬇️ Pobierz PDF",
+                        data=pdf_bytes,
+                        file_name="opowiadanie.pdf",
+                        mime="application/pdf",
+                        use_container_width=True
+                    )
                 except Exception as e:
                     st.error(f"❌ Błąd: {str(e)}")
 
@@ -495,6 +818,7 @@ with tab2:
             ebook_format = st.selectbox("Format eBook", ["EPUB", "MOBI"])
             if st.button(f"📚 Eksport do {ebook_format}", use_container_width=True):
                 try:
+                    selected_illustrations = finalize_export_images(selected_illustrations)
                     ebook_gen = EbookGenerator()
                     ebook_file = ebook_gen.create_ebook(
                         st.session_state.story_text,
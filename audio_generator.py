@@ -1,11 +1,14 @@
-from openai import OpenAI
 import os
 import tempfile
 from pydub import AudioSegment
 
+from openai_client import get_client
+from scheduler import get_scheduler
+
 class AudioGenerator:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key, client=None, scheduler=None):
+        self.client = client or get_client(api_key)
+        self.scheduler = scheduler or get_scheduler(api_key)
     
     def create_audiobook(self, story_text, voice="alloy", speed=1.0, split_chapters=False):
         """Tworzy audiobook z opowiadania"""
@@ -26,7 +29,9 @@ class AudioGenerator:
         
         for i, chunk in enumerate(text_chunks):
             try:
-                response = self.client.audio.speech.create(
+                response = self.scheduler.call(
+                    "speech",
+                    self.client.audio.speech.with_raw_response.create,
                     model="tts-1",
                     voice=voice,
                     input=chunk,
@@ -68,7 +73,9 @@ class AudioGenerator:
         
         for i, chapter in enumerate(chapters):
             try:
-                response = self.client.audio.speech.create(
+                response = self.scheduler.call(
+                    "speech",
+                    self.client.audio.speech.with_raw_response.create,
                     model="tts-1",
                     voice=voice,
                     input=chapter,
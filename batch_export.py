@@ -0,0 +1,221 @@
+import hashlib
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from anthology import LazyImages
+from ebook_generator import EbookGenerator
+from image_utils import attach_encoded, encoded_bytes
+from pdf_generator import PDFGenerator
+
+FORMATS = ("pdf", "epub")
+
+# Generatory tworzone raz na proces roboczy (czcionki, pamięć szerokości słów)
+_worker = {}
+
+
+# -----------------------------
+# ZADANIA
+# -----------------------------
+def make_job(job_id, story_text, author="", title="", cover_image=None, illustrations=None):
+    """
+    Zadanie eksportu do wysłania do procesu roboczego: sam tekst i bajty JPEG obrazów
+    (obrazy PIL nie są przesyłane między procesami).
+    """
+    return {
+        "id": str(job_id),
+        "text": story_text,
+        "author": author,
+        "title": title,
+        "cover": encoded_bytes(cover_image, "JPEG") if cover_image is not None else None,
+        "images": [encoded_bytes(img, "JPEG") for img in illustrations or []],
+    }
+
+
+def output_name(job_id):
+    """
+    Bezpieczna nazwa pliku dla identyfikatora zadania. Gdy oczyszczanie zmienia identyfikator,
+    dochodzi krótki skrót oryginału — "a b" i "a/b" nie trafią do tego samego pliku co "a_b".
+    """
+    name = re.sub(r"[^\w.-]+", "_", job_id).strip("._") or "zadanie"
+    if name != job_id:
+        name += "-" + hashlib.sha1(job_id.encode("utf-8")).hexdigest()[:8]
+    return name
+
+
+def output_path(output_dir, job_id, fmt):
+    """Ścieżka pliku wynikowego zadania"""
+    return os.path.join(output_dir, f"{output_name(job_id)}.{fmt}")
+
+
+def _init_worker(profile):
+    _worker["pdf"] = PDFGenerator(profile=profile)
+    _worker["epub"] = EbookGenerator()
+
+
+def _open_image(data):
+    if data is None:
+        return None
+    image = Image.open(io.BytesIO(data))
+    return attach_encoded(image, data, image.format or "JPEG")
+
+
+def _export_job(job, formats, output_dir):
+    """
+    Eksport jednego zadania w procesie roboczym.
+    Zwraca słownik: id, outputs {format: {path, seconds, bytes}}, errors {format: opis błędu}.
+    """
+    outputs = {}
+    errors = {}
+
+    for fmt in formats:
+        path = output_path(output_dir, job["id"], fmt)
+        started = time.perf_counter()
+        try:
+            # Obrazy dekodowane osobno dla każdego formatu — pomniejszenia PDF nie trafiają do EPUB
+            cover = _open_image(job["cover"])
+            illustrations = LazyImages(job["images"])
+
+            if fmt == "pdf":
+                data = _worker["pdf"].create_pdf(
+                    job["text"], job["author"], cover, illustrations, job["title"]
+                )
+                with open(path, "wb") as f:
+                    f.write(data)
+            elif fmt == "epub":
+                _worker["epub"].create_ebook(
+                    job["text"], job["author"], "epub", cover, list(illustrations), output_path=path
+                )
+            else:
+                raise ValueError(f"Nieobsługiwany format: {fmt}")
+
+            outputs[fmt] = {
+                "path": path,
+                "seconds": time.perf_counter() - started,
+                "bytes": os.path.getsize(path),
+            }
+        except Exception as e:
+            # Opis zamiast wyjątku — nie każdy wyjątek da się przesłać między procesami
+            errors[fmt] = f"{type(e).__name__}: {e}"
+
+    return {"id": job["id"], "outputs": outputs, "errors": errors}
+
+
+# -----------------------------
+# EKSPORT WSADOWY
+# -----------------------------
+class BatchExporter:
+    """
+    Eksport wielu opowiadań do PDF i EPUB w puli procesów (jeden rdzeń na proces).
+    Nieudane formaty są ponawiane w kolejnych rundach na nowej puli,
+    więc awaria procesu roboczego nie przerywa całego eksportu. Ponowienia widać
+    w on_job_done (wywołanie po każdej próbie) i w podsumowaniu (retried, rounds).
+    """
+
+    def __init__(self, max_workers=None, max_retries=2, profile="ebook"):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_retries = max_retries
+        self.profile = profile
+
+    def run(self, jobs, output_dir, formats=FORMATS, on_job_done=None):
+        """
+        jobs — słowniki z make_job. Pliki trafiają do output_dir jako <output_name(id)>.<format>.
+        on_job_done(id, wynik, błędy) wywoływane jest w wątku głównym po każdej próbie.
+        Zwraca podsumowanie (summary).
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        by_id = {job["id"]: job for job in jobs}
+        if len(by_id) != len(jobs):
+            raise ValueError("Identyfikatory zadań muszą być unikalne")
+        # Unikalne muszą być też nazwy plików — inaczej procesy nadpisywałyby sobie wyniki
+        names = {}
+        for job_id in by_id:
+            names.setdefault(output_name(job_id).lower(), []).append(job_id)
+        clashes = [ids for ids in names.values() if len(ids) > 1]
+        if clashes:
+            raise ValueError(f"Zadania dają te same nazwy plików: {clashes}")
+
+        pending = {job_id: tuple(formats) for job_id in by_id}
+        outputs = {job_id: {} for job_id in by_id}
+        errors = {}
+        attempts = {job_id: 0 for job_id in by_id}
+        rounds = 0
+        started = time.perf_counter()
+
+        for _ in range(self.max_retries + 1):
+            if not pending:
+                break
+            rounds += 1
+
+            failed = {}
+            with ProcessPoolExecutor(
+                max_workers=min(self.max_workers, len(pending)),
+                initializer=_init_worker,
+                initargs=(self.profile,)
+            ) as pool:
+                futures = {
+                    pool.submit(_export_job, by_id[job_id], job_formats, output_dir): job_id
+                    for job_id, job_formats in pending.items()
+                }
+
+                for future in as_completed(futures):
+                    job_id = futures[future]
+                    attempts[job_id] += 1
+                    try:
+                        result = future.result()
+                        job_errors = result["errors"]
+                        outputs[job_id].update(result["outputs"])
+                    except Exception as e:
+                        # Awaria procesu roboczego (np. BrokenProcessPool) — wszystkie formaty do ponowienia
+                        job_errors = {fmt: f"{type(e).__name__}: {e}" for fmt in pending[job_id]}
+
+                    if job_errors:
+                        failed[job_id] = tuple(job_errors)
+                        errors[job_id] = job_errors
+                    else:
+                        errors.pop(job_id, None)
+
+                    if on_job_done:
+                        on_job_done(job_id, outputs[job_id], job_errors)
+
+            pending = failed
+
+        return self.summary(outputs, errors, attempts, time.perf_counter() - started, formats, rounds)
+
+    def summary(self, outputs, errors, attempts, seconds, formats=FORMATS, rounds=1):
+        """Przepustowość: zadania/s, a dla każdego formatu liczba plików, p50/p95 czasu i rozmiar"""
+        completed = [job_id for job_id in outputs if job_id not in errors]
+        per_format = {}
+        for fmt in formats:
+            times = [o[fmt]["seconds"] for o in outputs.values() if fmt in o]
+            sizes = [o[fmt]["bytes"] for o in outputs.values() if fmt in o]
+            per_format[fmt] = {
+                "count": len(times),
+                "p50": _percentile(times, 50),
+                "p95": _percentile(times, 95),
+                "bytes": sum(sizes),
+            }
+
+        return {
+            "jobs": len(outputs),
+            "completed": len(completed),
+            "failed": {job_id: dict(errors[job_id]) for job_id in errors},
+            "retried": sum(1 for n in attempts.values() if n > 1),
+            "rounds": rounds,
+            "workers": self.max_workers,
+            "seconds": seconds,
+            "jobs_per_second": len(completed) / seconds if seconds else 0.0,
+            "formats": per_format,
+            "outputs": outputs,
+        }
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
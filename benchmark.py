@@ -0,0 +1,243 @@
+import io
+import os
+import random
+import re
+import tempfile
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+from reportlab.pdfbase import pdfmetrics
+
+from batch_export import BatchExporter, make_job
+from image_utils import attach_encoded
+from pdf_generator import EXPORT_PROFILES, PDFGenerator
+
+# -----------------------------
+# USTAWIENIA
+# -----------------------------
+WORD_COUNT = 3500
+REPEATS = 5
+FONT_SIZE = 12
+TEXT_WIDTH = 595.27 - 60 - 60  # A4 minus marginesy z PDFGenerator
+
+WORDS = (
+    "dawno temu w małym miasteczku nad rzeką mieszkała dziewczynka która "
+    "codziennie rano wychodziła do lasu szukać śladów smoka o złotych łuskach "
+    "pewnego dnia znalazła tajemniczą mapę narysowaną na starym pergaminie "
+    "przyjaciele postanowili wyruszyć razem w podróż pełną przygód niespodzianek "
+    "i odważnych decyzji aż w końcu odkryli że prawdziwym skarbem jest przyjaźń"
+).split()
+
+
+def make_story(word_count, seed=7):
+    """Opowiadanie testowe: akapity po 40–120 słów"""
+    rng = random.Random(seed)
+    paragraphs = []
+    remaining = word_count
+    while remaining > 0:
+        length = min(remaining, rng.randint(40, 120))
+        words = [rng.choice(WORDS) for _ in range(length)]
+        words[0] = words[0].capitalize()
+        paragraphs.append(" ".join(words) + ".")
+        remaining -= length
+    return "\n\n".join(paragraphs)
+
+
+# -----------------------------
+# POPRZEDNIE ZAWIJANIE (dla porównania)
+# -----------------------------
+def legacy_wrap(paragraph, font_name, font_size, max_width):
+    words = paragraph.split()
+    lines = []
+    current_line = ""
+
+    for word in words:
+        test_line = word if not current_line else current_line + " " + word
+        line_width = pdfmetrics.stringWidth(test_line, font_name, font_size)
+
+        if line_width <= max_width:
+            current_line = test_line
+        else:
+            if current_line:
+                lines.append(current_line)
+            current_line = word
+
+    if current_line:
+        lines.append(current_line)
+
+    return lines
+
+
+def best_time(func, repeats=REPEATS):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def ragged_score(lines_per_paragraph, font_name):
+    """Suma kwadratów wolnego miejsca (bez ostatnich linii akapitów) — im mniej, tym równiej"""
+    total = 0.0
+    for lines in lines_per_paragraph:
+        for line in lines[:-1]:
+            total += (TEXT_WIDTH - pdfmetrics.stringWidth(line, font_name, FONT_SIZE)) ** 2
+    return total
+
+
+# -----------------------------
+# BENCHMARK ZAWIJANIA
+# -----------------------------
+def bench_wrapping():
+    greedy = PDFGenerator()
+    optimal = PDFGenerator(line_breaking="optimal")
+    font_name = greedy.font_name
+    paragraphs = greedy._split_into_paragraphs(make_story(WORD_COUNT))
+
+    print(f"\n=== Zawijanie tekstu: {WORD_COUNT} słów, {len(paragraphs)} akapitów, czcionka {font_name} ===")
+
+    legacy_time, legacy_lines = best_time(
+        lambda: [legacy_wrap(p, font_name, FONT_SIZE, TEXT_WIDTH) for p in paragraphs]
+    )
+    # Pierwszy przebieg wypełnia pamięć szerokości słów — mierzymy go osobno
+    cold_time, _ = best_time(
+        lambda: [greedy._wrap_paragraph(p, FONT_SIZE, TEXT_WIDTH) for p in paragraphs], repeats=1
+    )
+    greedy_time, greedy_lines = best_time(
+        lambda: [greedy._wrap_paragraph(p, FONT_SIZE, TEXT_WIDTH) for p in paragraphs]
+    )
+    optimal_time, optimal_lines = best_time(
+        lambda: [optimal._wrap_paragraph(p, FONT_SIZE, TEXT_WIDTH) for p in paragraphs]
+    )
+
+    rows = [
+        ("poprzednie (stringWidth całej linii)", legacy_time, legacy_lines),
+        ("zachłanne, pierwszy przebieg", cold_time, greedy_lines),
+        ("zachłanne (pamięć szerokości słów)", greedy_time, greedy_lines),
+        ("total-fit (Knuth–Plass)", optimal_time, optimal_lines),
+    ]
+    for label, seconds, lines in rows:
+        print(
+            f"{label:<40} {seconds * 1000:8.2f} ms   "
+            f"{sum(len(l) for l in lines):5d} linii   "
+            f"nierówność {ragged_score(lines, font_name):12.0f}"
+        )
+
+    if legacy_lines == greedy_lines:
+        print("✅ Zawijanie zachłanne daje te same linie co poprzednie")
+    else:
+        print("⚠️ Zawijanie zachłanne daje inne linie niż poprzednie")
+    print(f"Przyspieszenie: {legacy_time / greedy_time:.1f}×")
+
+
+# -----------------------------
+# BENCHMARK PROFILI OBRAZÓW W PDF
+# -----------------------------
+def make_jpeg(seed, size=1024):
+    """Bajty obrazu testowego podobnego do ilustracji z API: gradient, kształty i szum, JPEG q85"""
+    rng = random.Random(seed)
+    img = Image.radial_gradient("L").resize((size, size)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randint(20, 200)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    img = img.filter(ImageFilter.GaussianBlur(3))
+    noise = Image.effect_noise((size, size), 24).convert("RGB")
+    img = Image.blend(img, noise, 0.15)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def open_jpeg(data):
+    return attach_encoded(Image.open(io.BytesIO(data)), data, "jpeg")
+
+
+def count_images(pdf_bytes):
+    return len(re.findall(rb"/Subtype /Image", pdf_bytes))
+
+
+def bench_profiles():
+    story = make_story(WORD_COUNT)
+    jpegs = [make_jpeg(seed) for seed in range(5)]
+
+    print(f"\n=== Eksport PDF: okładka + 5 ilustracji (w tym 1 powtórzona), {WORD_COUNT} słów ===")
+
+    for name in [None] + list(EXPORT_PROFILES):
+        def export():
+            # Nowe obrazy przy każdym przebiegu — bez zapamiętanych pomniejszeń
+            cover, *illustrations = [open_jpeg(data) for data in jpegs]
+            # Ta sama ilustracja dwa razy — ma trafić do PDF jako jeden obiekt
+            illustrations.append(illustrations[0])
+            return PDFGenerator(profile=name).create_pdf(story, "Autor", cover, illustrations, "Tytuł")
+
+        seconds, pdf_bytes = best_time(export, repeats=3)
+        label = name or "oryginał (bajty z API)"
+        print(
+            f"{label:<24} {len(pdf_bytes) / 1024:8.0f} KB   {seconds * 1000:8.1f} ms   "
+            f"obrazy w pliku: {count_images(pdf_bytes)}"
+        )
+
+
+# -----------------------------
+# STATYSTYKI TREŚCI PDF
+# -----------------------------
+def bench_text_stats():
+    stats = []
+    PDFGenerator().create_pdf(make_story(WORD_COUNT), "Autor", title="Tytuł", on_stats=stats.append)
+    report = stats[0]
+    body = [p for p in report["pages"] if p["glyphs"]]
+
+    print(f"\n=== Treść PDF: {report['page_count']} stron, {report['file_bytes'] / 1024:.0f} KB ===")
+    print(f"Strumienie treści: {report['content_bytes']} B, "
+          f"{report['content_bytes'] / max(1, len(body)):.0f} B na stronę tekstu")
+    print(f"Znaki: {report['glyphs']}, "
+          f"{report['content_bytes'] * 8 / max(1, report['glyphs']):.2f} bita na znak")
+    print(f"{'✅' if report['font_subset'] else '⚠️'} Czcionka {report['font']} "
+          f"{'osadzona jako podzbiór' if report['font_subset'] else 'nie jest osadzona jako podzbiór'}")
+
+
+# -----------------------------
+# EKSPORT WSADOWY
+# -----------------------------
+BATCH_JOBS = 24
+
+
+def bench_batch():
+    jpegs = [make_jpeg(seed) for seed in range(3)]
+    jobs = [
+        make_job(f"opowiadanie_{i}", make_story(WORD_COUNT, seed=i), "Autor", f"Tytuł {i}",
+                 open_jpeg(jpegs[0]), [open_jpeg(data) for data in jpegs[1:]])
+        for i in range(BATCH_JOBS)
+    ]
+    cores = os.cpu_count() or 1
+
+    print(f"\n=== Eksport wsadowy: {BATCH_JOBS} opowiadań do PDF i EPUB, {cores} rdzeni ===")
+
+    baseline = None
+    for workers in sorted({1, cores}):
+        with tempfile.TemporaryDirectory() as output_dir:
+            summary = BatchExporter(max_workers=workers).run(jobs, output_dir)
+        baseline = baseline or summary["jobs_per_second"]
+        formats = "   ".join(
+            f"{fmt} p50 {s['p50'] * 1000:.0f} ms / p95 {s['p95'] * 1000:.0f} ms"
+            for fmt, s in summary["formats"].items() if s["count"]
+        )
+        print(
+            f"{workers:2d} proc.   {summary['jobs_per_second']:6.2f} zadań/s   "
+            f"×{summary['jobs_per_second'] / baseline:.1f}   {formats}"
+        )
+        if summary["failed"]:
+            print(f"⚠️ Nieudane zadania: {', '.join(summary['failed'])}")
+
+
+if __name__ == "__main__":
+    bench_wrapping()
+    bench_profiles()
+    bench_text_stats()
+    bench_batch()
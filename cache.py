@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Katalog pamięci podręcznej (można nadpisać zmienną środowiskową)
+CACHE_DIR = os.getenv(
+    "FABRYKA_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "fabryka-opowiadan")
+)
+
+
+class DiskCache:
+    """
+    Trwała pamięć podręczna klucz → bajty w SQLite.
+    Rozmiar ograniczony (usuwanie najdawniej używanych — LRU), wpisy wygasają po TTL.
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON entries(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        """Klucz treściowy — skrót SHA-256 z podanych elementów"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return bytes(value)
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Usuwa wygasłe wpisy, a potem najdawniej używane aż rozmiar zmieści się w limicie"""
+        if self.ttl:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC")
+        to_delete = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", to_delete)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": count,
+            "bytes": total
+        }
+
+
+class CompletionCache(DiskCache):
+    """Pamięć podręczna odpowiedzi czatu, klucz: (rodzaj wywołania, model, prompt, temperatura)"""
+
+    def get_text(self, kind, model, prompt, temperature):
+        value = self.get(self.make_key(kind, model, prompt, temperature))
+        return value.decode("utf-8") if value is not None else None
+
+    def set_text(self, kind, model, prompt, temperature, text):
+        self.set(self.make_key(kind, model, prompt, temperature), text.encode("utf-8"))
+
+
+class ImageCache(DiskCache):
+    """
+    Pamięć podręczna obrazów, klucz: (prompt po oczyszczeniu, styl, rozmiar, model,
+    opcje wyjścia — jakość, format, kompresja).
+    Przechowuje oryginalne zakodowane bajty (PNG/JPEG), nie obiekty PIL —
+    dekodowanie następuje dopiero przy odczycie.
+    """
+
+    def __init__(self, path, max_bytes=500 * 1024 * 1024, ttl=30 * 24 * 3600):
+        super().__init__(path, max_bytes=max_bytes, ttl=ttl)
+
+    def get_bytes(self, prompt, style, size, model, options=None):
+        return self.get(self.make_key(prompt, style, size, model, options or {}))
+
+    def set_bytes(self, prompt, style, size, model, data, options=None):
+        self.set(self.make_key(prompt, style, size, model, options or {}), data)
+
+
+_shared_caches = {}
+_cache_lock = threading.Lock()
+
+
+def _get_shared(name, factory):
+    with _cache_lock:
+        if name not in _shared_caches:
+            try:
+                _shared_caches[name] = factory(os.path.join(CACHE_DIR, f"{name}.sqlite"))
+            except Exception as e:
+                print(f"⚠️ Pamięć podręczna '{name}' niedostępna ({e}) — działam bez niej.")
+                _shared_caches[name] = None
+        return _shared_caches[name]
+
+
+def get_completion_cache():
+    """Współdzielona (na proces) pamięć podręczna odpowiedzi czatu"""
+    return _get_shared("completions", CompletionCache)
+
+
+def get_image_cache():
+    """Współdzielona (na proces) pamięć podręczna obrazów"""
+    return _get_shared("images", ImageCache)
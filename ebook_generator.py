@@ -1,28 +1,29 @@
 from ebooklib import epub
 import os
 import tempfile
-from PIL import Image
-import io
+
+from image_utils import encoded_bytes
 
 class EbookGenerator:
     def __init__(self):
         pass
     
-    def create_ebook(self, story_text, author_name, format_type="epub", cover_image=None, illustrations=None):
-        """Tworzy eBook w formacie EPUB lub MOBI"""
+    def create_ebook(self, story_text, author_name, format_type="epub", cover_image=None, illustrations=None,
+                     output_path=None):
+        """Tworzy eBook w formacie EPUB lub MOBI (output_path — ścieżka pliku, domyślnie katalog tymczasowy)"""
         
         if format_type.lower() == "epub":
-            return self._create_epub(story_text, author_name, cover_image, illustrations)
+            return self._create_epub(story_text, author_name, cover_image, illustrations, output_path)
         elif format_type.lower() == "mobi":
             # MOBI wymaga konwersji z EPUB (można użyć Calibre CLI)
-            epub_file = self._create_epub(story_text, author_name, cover_image, illustrations)
+            epub_file = self._create_epub(story_text, author_name, cover_image, illustrations, output_path)
             # W prawdziwej implementacji tutaj byłaby konwersja do MOBI
             # Na potrzeby demonstracji zwracamy EPUB
             return epub_file
         else:
             raise ValueError("Nieobsługiwany format. Użyj 'epub' lub 'mobi'")
     
-    def _create_epub(self, story_text, author_name, cover_image, illustrations):
+    def _create_epub(self, story_text, author_name, cover_image, illustrations, output_path=None):
         """Tworzy eBook w formacie EPUB"""
         
         book = epub.EpubBook()
@@ -35,12 +36,8 @@ class EbookGenerator:
         
         # Okładka
         if cover_image:
-            # Konwertuj PIL Image do bajtów
-            img_byte_arr = io.BytesIO()
-            cover_image.save(img_byte_arr, format='JPEG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            book.set_cover("cover.jpg", img_byte_arr)
+            # Bajty JPEG obrazu (bez ponownego kodowania, jeśli już są w tym formacie)
+            book.set_cover("cover.jpg", encoded_bytes(cover_image, "JPEG"))
         
         # Strona tytułowa
         title_page = epub.EpubHtml(
@@ -76,13 +73,9 @@ class EbookGenerator:
         # Dodaj ilustracje jako oddzielne pliki
         if illustrations:
             for idx, img in enumerate(illustrations):
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG')
-                img_byte_arr = img_byte_arr.getvalue()
-                
                 img_item = epub.EpubImage()
                 img_item.file_name = f'illustration_{idx}.jpg'
-                img_item.content = img_byte_arr
+                img_item.content = encoded_bytes(img, "JPEG")
                 book.add_item(img_item)
         
         # Spis treści
@@ -99,7 +92,8 @@ class EbookGenerator:
         book.spine = ['nav', title_page, content_chapter]
         
         # Zapisz EPUB
-        output_path = os.path.join(tempfile.gettempdir(), "opowiadanie.epub")
+        if output_path is None:
+            output_path = os.path.join(tempfile.gettempdir(), "opowiadanie.epub")
         epub.write_epub(output_path, book)
         
         return output_path
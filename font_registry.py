@@ -0,0 +1,94 @@
+import os
+import threading
+
+from PIL import ImageFont
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+# Katalog czcionek względem pakietu (niezależnie od katalogu roboczego)
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+# Odmiany: plik TTF i nazwa w ReportLab; gdy pliku brak — czcionka zastępcza ReportLab
+FONT_VARIANTS = {
+    "regular": {"file": "DejaVuSans.ttf", "name": "DejaVuSans", "fallback": "Helvetica"},
+    "bold": {"file": "DejaVuSans-Bold.ttf", "name": "DejaVuSans-Bold", "fallback": "Helvetica-Bold"},
+}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class FontRegistry:
+    """
+    Czcionki rozwiązywane i rejestrowane w ReportLab raz na proces.
+    Kolejność szukania pliku: katalog fonts/ pakietu, czcionki systemowe (wyszukiwanie PIL),
+    a dla pogrubionej — zwykła odmiana. Wynik i ewentualne zastępstwa są w report().
+    """
+
+    def __init__(self, font_dir=FONT_DIR):
+        self.font_dir = font_dir
+        self._paths = {}
+        self._names = {}
+        self._report = {}
+
+        for variant, spec in FONT_VARIANTS.items():
+            self._resolve(variant, spec)
+
+        for variant, entry in self._report.items():
+            if entry["fallback"]:
+                print(f"⚠️ Czcionka '{variant}': {entry['fallback']}")
+
+    def _resolve(self, variant, spec):
+        path = self._find_file(spec["file"])
+        fallback = None
+
+        if path is None and variant != "regular":
+            # Brak pogrubionej — używamy zwykłej
+            path = self._paths.get("regular")
+            name = self._names.get("regular")
+            fallback = f"brak pliku {spec['file']} — używam odmiany zwykłej ({name})"
+        elif path is None:
+            name = spec["fallback"]
+            fallback = f"brak pliku {spec['file']} — PDF użyje {name}, okładki czcionki domyślnej PIL"
+        else:
+            name = spec["name"]
+            try:
+                pdfmetrics.registerFont(TTFont(name, path))
+            except Exception as e:
+                name = spec["fallback"]
+                fallback = f"nie udało się wczytać {path} ({e}) — PDF użyje {name}"
+
+        self._paths[variant] = path
+        self._names[variant] = name
+        self._report[variant] = {"path": path, "reportlab": name, "fallback": fallback}
+
+    def _find_file(self, filename):
+        local = os.path.join(self.font_dir, filename)
+        if os.path.exists(local):
+            return local
+        try:
+            # PIL przeszukuje systemowe katalogi czcionek po nazwie pliku
+            return ImageFont.truetype(filename, 10).path
+        except OSError:
+            return None
+
+    def path(self, variant="regular"):
+        """Ścieżka pliku TTF dla PIL (None — czcionka domyślna PIL)"""
+        return self._paths[variant]
+
+    def reportlab_name(self, variant="regular"):
+        """Nazwa czcionki zarejestrowanej w ReportLab"""
+        return self._names[variant]
+
+    def report(self):
+        """Dla każdej odmiany: ścieżka, nazwa w ReportLab i opis zastępstwa (None, gdy brak)"""
+        return {variant: dict(entry) for variant, entry in self._report.items()}
+
+
+def get_font_registry():
+    """Współdzielony rejestr czcionek (tworzony przy pierwszym użyciu)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FontRegistry()
+        return _registry
@@ -0,0 +1,93 @@
+import io
+import threading
+import weakref
+
+from PIL import Image
+
+# Zakodowane bajty obrazów (źródło prawdy) i ich pomniejszone wersje — klucz to id obiektu PIL.
+# Wpis znika razem z obrazem; kopia obrazu (np. z nałożonym tytułem) nie dziedziczy bajtów.
+_encoded = {}
+_lock = threading.Lock()
+
+# Nazwy formatów API → nazwy formatów PIL
+FORMAT_NAMES = {
+    "jpeg": "JPEG",
+    "jpg": "JPEG",
+    "webp": "WEBP",
+    "png": "PNG"
+}
+
+
+def attach_encoded(image, data, image_format):
+    """Zapamiętuje oryginalne bajty obrazu w danym formacie (np. odpowiedź API)"""
+    _store(image, FORMAT_NAMES.get(image_format.lower(), image_format.upper()), data)
+    return image
+
+
+def encoded_bytes(image, image_format="JPEG", quality=90):
+    """
+    Bajty obrazu w żądanym formacie. Jeśli obraz ma już bajty w tym formacie,
+    zwraca je bez ponownego kodowania; w przeciwnym razie koduje raz i zapamiętuje.
+    """
+    image_format = FORMAT_NAMES.get(image_format.lower(), image_format.upper())
+
+    with _lock:
+        cached = _encoded.get(id(image), {}).get(image_format)
+    if cached is not None:
+        return cached
+
+    source = image
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        source = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    source.save(buffer, format=image_format, quality=quality)
+    data = buffer.getvalue()
+    _store(image, image_format, data)
+    return data
+
+
+def resampled_bytes(image, size, quality=85, progressive=False, subsampling="4:2:0"):
+    """
+    JPEG obrazu zmniejszonego do `size` filtrem Lanczos, z podanymi ustawieniami kodowania.
+    Liczony raz dla danego obrazu i ustawień, potem zwracany z pamięci.
+    """
+    key = ("JPEG", tuple(size), quality, progressive, subsampling)
+    with _lock:
+        cached = _encoded.get(id(image), {}).get(key)
+    if cached is not None:
+        return cached
+
+    source = image.convert("RGB") if image.mode not in ("RGB", "L") else image
+    if source.size != tuple(size):
+        source = source.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    source.save(
+        buffer, format="JPEG", quality=quality, optimize=True,
+        progressive=progressive, subsampling=subsampling
+    )
+    data = buffer.getvalue()
+    _store(image, key, data)
+    return data
+
+
+def encoded_format(image):
+    """Format, w którym obraz ma zapamiętane oryginalne bajty (None, jeśli żaden)"""
+    with _lock:
+        formats = _encoded.get(id(image)) or {}
+        return next((f for f in formats if isinstance(f, str)), None)
+
+
+def _store(image, image_format, data):
+    key = id(image)
+    with _lock:
+        if key not in _encoded:
+            _encoded[key] = {}
+            weakref.finalize(image, _forget, key)
+        _encoded[key][image_format] = data
+
+
+def _forget(key):
+    with _lock:
+        _encoded.pop(key, None)
@@ -0,0 +1,61 @@
+import atexit
+import os
+import threading
+
+import httpx
+import openai
+
+# Limity puli połączeń (można nadpisać zmiennymi środowiskowymi)
+POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "10"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_POOL_KEEPALIVE_EXPIRY", "120"))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(api_key):
+    """Zwraca współdzielonego klienta OpenAI dla danego klucza (jeden na proces)"""
+    with _lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _create_client(api_key)
+            _clients[api_key] = client
+        return client
+
+
+def _create_client(api_key):
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+        ),
+        timeout=openai.DEFAULT_TIMEOUT,
+        follow_redirects=True
+    )
+    # Ponawianiem zajmuje się scheduler.RequestScheduler — bez podwójnych prób
+    return openai.OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def close_client(api_key):
+    """Zamyka klienta dla danego klucza i zwalnia jego połączenia"""
+    with _lock:
+        client = _clients.pop(api_key, None)
+    if client is not None:
+        client.close()
+
+
+def close_all():
+    """Zamyka wszystkich klientów — wywoływane automatycznie przy wyjściu z procesu"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_all)
@@ -1,34 +1,85 @@
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
 from PIL import Image
-import os
-import tempfile
+import hashlib
+import io
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+from font_registry import get_font_registry
+from image_utils import encoded_bytes, encoded_format, resampled_bytes
+from text_layout import fit_text, reportlab_measurer, wrap_optimal, wrap_words
+
+# Celowe ustawienie globalne dla całego procesu: strumienie binarne zamiast ASCII85
+# (kodowanie tekstowe powiększa obrazy i treść stron o ~25%). ReportLab nie ma takiej opcji
+# dla pojedynczego płótna — odczytuje ją przy rysowaniu obrazów i przy zapisie pliku.
+rl_config.useA85 = 0
+
+# Ostatnio policzone układy stron — zmiana samego tytułu nie wymaga ponownego łamania
+MAX_LAYOUTS = 8
+_layouts = OrderedDict()
+_layouts_lock = threading.Lock()
+
+# Profile eksportu obrazów: docelowa rozdzielczość przy rysowanym rozmiarze, jakość JPEG,
+# kodowanie progresywne i podpróbkowanie chrominancji. None — oryginalne bajty z API.
+EXPORT_PROFILES = {
+    "screen": {"dpi": 96, "quality": 70, "progressive": True, "subsampling": "4:2:0"},
+    "ebook": {"dpi": 150, "quality": 80, "progressive": True, "subsampling": "4:2:0"},
+    "print": {"dpi": 300, "quality": 92, "progressive": False, "subsampling": "4:4:4"},
+}
+
+# Krótki akapit bez kropki na końcu albo "Rozdział …" / "# …" traktujemy jak śródtytuł
+HEADING_PATTERN = re.compile(r"^(#+\s*\S|(Rozdział|Część)\s+\S+)")
 
-class PDFGenerator:
-    def __init__(self):
-        font_path = "fonts/DejaVuSans.ttf"
 
-        try:
-            if os.path.exists(font_path):
-                pdfmetrics.registerFont(TTFont("DejaVuSans", font_path))
-                self.font_name = "DejaVuSans"
-            else:
-                print("⚠️ Brak czcionki — używam Helvetica.")
-                self.font_name = "Helvetica"
-        except:
-            self.font_name = "Helvetica"
+class PDFGenerator:
+    # Układ stron treści (punkty)
+    MARGIN = 60
+    FONT_SIZE = 12
+    LINE_HEIGHT = 16
+    FIRST_LINE_INDENT = 25
+    ILLUSTRATION_BOX = (100, 400, 400)  # x, szerokość, wysokość
+    ILLUSTRATION_MIN_Y = 450
+
+    def __init__(self, line_breaking="greedy", profile="ebook"):
+        # "greedy" — szybkie zawijanie w jednym przebiegu, "optimal" — równiejsza prawa krawędź
+        self.line_breaking = line_breaking
+        # Klucz EXPORT_PROFILES albo None (obrazy bez zmian)
+        self.profile = EXPORT_PROFILES[profile] if profile else None
+        self._readers = {}
+        self._page_stats = None
+
+        # Czcionki zarejestrowane raz na proces we wspólnym rejestrze
+        fonts = get_font_registry()
+        self.font_name = fonts.reportlab_name("regular")
+        self.bold_font_name = fonts.reportlab_name("bold")
 
         self.page_number = 0
 
     # -----------------------------
     # GŁÓWNY GENERATOR PDF
     # -----------------------------
-    def create_pdf(self, story_text, author, cover_image=None, illustrations=None, title=""):
-        output_path = os.path.join(tempfile.gettempdir(), 'output.pdf')
-        c = canvas.Canvas(output_path, pagesize=A4)
+    def create_pdf(self, story_text, author, cover_image=None, illustrations=None, title="", toc=False,
+                   on_stats=None):
+        """
+        Składa PDF w pamięci i zwraca jego bajty (bez zapisu na dysk).
+        on_stats(statystyki) — opcjonalnie: rozmiar treści i liczba znaków na stronę,
+        rozmiar pliku oraz czy czcionka jest osadzona jako podzbiór.
+        """
+        illustrations = illustrations or []
+        index = self.paginate(story_text, len(illustrations))
+
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
         width, height = A4
+        # Jeden czytnik na identyczne bajty — ReportLab osadza wtedy jeden wspólny obiekt obrazu
+        self._readers = {}
+        # Statystyki stron liczone tylko na żądanie (dodatkowa kompresja treści każdej strony)
+        self._page_stats = [] if on_stats else None
 
         # Okładka (tylko jeśli została wygenerowana)
         if cover_image:
@@ -36,12 +87,61 @@ class PDFGenerator:
         
         # Strona tytułowa
         self._add_title_page(c, author, title, width, height)
+
+        # Spis treści (numery stron z indeksu — bez ponownego łamania)
+        if toc:
+            self._add_toc_page(c, self.table_of_contents(index), width, height)
         
         # Treść
-        self._add_story_content(c, story_text, illustrations, width, height, title)
+        self._draw_story_content(c, index, illustrations, title)
 
         c.save()
-        return output_path
+        data = buffer.getvalue()
+
+        if on_stats:
+            on_stats(self._export_stats(data))
+        return data
+
+    # -----------------------------
+    # DOKUMENT WIELU OPOWIADAŃ (rysowanie na płótnie wywołującego)
+    # -----------------------------
+    def start_document(self, c, title="", author=""):
+        """Przygotowuje nowy dokument na płótnie c; z tytułem lub autorem rysuje nienumerowaną stronę tytułową"""
+        self._readers = {}
+        self._page_stats = None
+        self.page_number = 0
+        if title or author:
+            width, height = A4
+            self._add_title_page(c, author, title, width, height)
+
+    def draw_story(self, c, record, first_page):
+        """
+        Rysuje opowiadanie od strony first_page: numerowaną stronę otwierającą (tytuł, autor)
+        i treść z ciągłą numeracją. record: text, title, author, images (obrazy do rysowania).
+        Układ stron nie trafia do pamięci układów, a czytniki obrazów są zwalniane po opowiadaniu.
+        Zwraca liczbę narysowanych stron.
+        """
+        width, height = A4
+        title = record.get("title", "")
+        illustrations = record.get("images") or []
+
+        self._add_title_page(c, record.get("author", ""), title, width, height, page_number=first_page)
+        index = self._layout(record["text"], len(illustrations))
+        self._draw_story_content(c, index, illustrations, title, page_offset=first_page)
+
+        # Czytniki obrazów trzymają zdekodowane piksele — nie przenosimy ich do kolejnego opowiadania
+        self._readers = {}
+        return 1 + len(index["pages"])
+
+    def draw_toc(self, c, entries):
+        """Spis treści z pozycji {"label", "page"}"""
+        width, height = A4
+        self._add_toc_page(c, entries, width, height)
+
+    def estimate_pages(self, story_text, illustration_count=0, cover=False, toc=False):
+        """Liczba stron PDF (z okładką, stroną tytułową i spisem treści)"""
+        index = self.paginate(story_text, illustration_count)
+        return len(index["pages"]) + 1 + int(bool(cover)) + int(bool(toc))
 
     # -----------------------------
     # OKŁADKA
@@ -50,92 +150,271 @@ class PDFGenerator:
         self.page_number = 0
 
         if hasattr(cover_image, 'save'):
-            img_resized = cover_image.copy().resize((int(width), int(height)))
-            temp_image_path = os.path.join(tempfile.gettempdir(), 'temp_cover.jpg')
-            img_resized.save(temp_image_path)
-            c.drawImage(temp_image_path, 0, 0)
-            os.remove(temp_image_path)
+            # Okładka w całości i bez zniekształceń; wolne pasy w średnim kolorze okładki
+            img_width, img_height = cover_image.size
+            scale = min(width / img_width, height / img_height)
+            draw_width, draw_height = img_width * scale, img_height * scale
 
-        c.showPage()
+            background = cover_image.convert("RGB").resize((1, 1), Image.BOX).getpixel((0, 0))
+            c.setFillColorRGB(*(channel / 255 for channel in background))
+            c.rect(0, 0, width, height, stroke=0, fill=1)
+
+            self._draw_image(
+                c, cover_image,
+                (width - draw_width) / 2, (height - draw_height) / 2,
+                draw_width, draw_height
+            )
+
+        self._end_page(c)
 
     # -----------------------------
     # STRONA TYTUŁOWA
     # -----------------------------
-    def _add_title_page(self, c, author, title, width, height):
-        self.page_number = 0
+    def _add_title_page(self, c, author, title, width, height, page_number=0):
+        """Tytuł i autor; page_number > 0 — strona numerowana (np. otwarcie opowiadania w antologii)"""
+        self.page_number = page_number
+
+        author_y = height - 200
 
-        # Tytuł (jeśli jest)
+        # Tytuł (jeśli jest) — rozmiar dobrany tak, żeby zmieścił się w ramce
         if title:
-            c.setFont(self.font_name, 28)
-            c.drawCentredString(width / 2, height - 150, title)
+            layout = fit_text(
+                title, reportlab_measurer(self.bold_font_name),
+                box_width=width - 120, box_height=140,
+                min_size=14, max_size=28
+            )
+            c.setFont(self.bold_font_name, layout["size"])
+            y = height - 150
+            for line in layout["lines"]:
+                c.drawCentredString(width / 2, y, line)
+                y -= layout["line_height"]
+            author_y = min(author_y, y - 16)
         
         # Autor
-        c.setFont(self.font_name, 16)
-        c.drawCentredString(width / 2, height - 200, f"Autor: {author}")
+        if author:
+            c.setFont(self.font_name, 16)
+            c.drawCentredString(width / 2, author_y, f"Autor: {author}")
 
-        c.showPage()
+        if page_number:
+            self._draw_page_number(c, width, height)
+        self._end_page(c)
 
     # -----------------------------
-    # TREŚĆ — wersja książkowa (bez justowania)
+    # SPIS TREŚCI
     # -----------------------------
-    def _add_story_content(self, c, story_text, illustrations, width, height, title):
-        self.page_number = 1
+    def _add_toc_page(self, c, entries, width, height):
+        c.setFont(self.bold_font_name, 20)
+        c.drawCentredString(width / 2, height - 100, "Spis treści")
+
+        c.setFont(self.font_name, 12)
+        y = height - 150
+        for entry in entries:
+            if y < self.MARGIN:
+                self._end_page(c)
+                c.setFont(self.font_name, 12)
+                y = height - 100
+            c.drawString(self.MARGIN, y, entry["label"])
+            c.drawRightString(width - self.MARGIN, y, str(entry["page"]))
+            y -= 20
+
+        self._end_page(c)
+
+    def table_of_contents(self, index):
+        """Śródtytuły i ilustracje z numerami stron — prosto z indeksu stron"""
+        entries = []
+        for page in index["pages"]:
+            for paragraph, first_line, _, _ in page["runs"]:
+                if first_line == 0 and paragraph in index["headings"]:
+                    label = " ".join(index["paragraphs"][paragraph]).lstrip("# ")
+                    entries.append({"label": label, "page": page["number"]})
+            for image_index, _, _, _, _ in page["illustrations"]:
+                entries.append({"label": f"Ilustracja {image_index + 1}", "page": page["number"]})
+        return entries
 
-        left_margin = 60
-        right_margin = 60
-        top_margin = height - 60
-        bottom_margin = 60
-        line_height = 16
-        first_line_indent = 25
-        font_size = 12
-
-        text_width = width - left_margin - right_margin
-        y = top_margin
+    # -----------------------------
+    # UKŁAD STRON — osobny przebieg przed rysowaniem
+    # -----------------------------
+    def paginate(self, story_text, illustration_count=0):
+        """
+        Indeks stron treści: dla każdej strony numer, czy ma nagłówek, ciągi linii
+        (akapit, pierwsza linia, liczba linii, y) i miejsca na ilustracje
+        (indeks, x, y, szerokość, wysokość). Tytuł nie wpływa na układ,
+        więc indeks z pamięci służy też po zmianie tytułu.
+        """
+        key = (
+            hashlib.sha256(story_text.encode("utf-8")).hexdigest(),
+            illustration_count,
+            self.font_name,
+            self.line_breaking
+        )
+        with _layouts_lock:
+            if key in _layouts:
+                _layouts.move_to_end(key)
+                return _layouts[key]
+
+        index = self._layout(story_text, illustration_count)
+
+        with _layouts_lock:
+            _layouts[key] = index
+            while len(_layouts) > MAX_LAYOUTS:
+                _layouts.popitem(last=False)
+        return index
+
+    def _layout(self, story_text, illustration_count):
+        width, height = A4
+        top_margin = height - self.MARGIN
+        bottom_margin = self.MARGIN
+        line_height = self.LINE_HEIGHT
+        text_width = width - 2 * self.MARGIN
 
         paragraphs = self._split_into_paragraphs(story_text)
-        illustration_index = 0
+        wrapped = [self._wrap_paragraph(p, self.FONT_SIZE, text_width) for p in paragraphs]
+
+        # Pierwsza strona treści jest bez nagłówka
+        pages = [{"number": 1, "header": False, "runs": [], "illustrations": []}]
+
+        def new_page():
+            pages.append({
+                "number": pages[-1]["number"] + 1,
+                "header": True,
+                "runs": [],
+                "illustrations": []
+            })
+            return top_margin
+
+        def place_illustration(image_index, y):
+            if y < self.ILLUSTRATION_MIN_Y:
+                y = new_page()
+            x, w, h = self.ILLUSTRATION_BOX
+            pages[-1]["illustrations"].append((image_index, x, y - h, w, h))
+            return y - h - 20
 
-        # Nagłówek z tytułem (jeśli jest) zamiast "Opowiadanie"
-        header_text = title if title else ""
-
-        for paragraph in paragraphs:
-            c.setFont(self.font_name, font_size)
-
-            lines = self._wrap_paragraph(paragraph, font_size, text_width)
+        y = top_margin
+        illustration_index = 0
 
-            first = True
-            for line in lines:
+        for paragraph_index, lines in enumerate(wrapped):
+            run = None
+            for line_index in range(len(lines)):
                 if y < bottom_margin + line_height:
-                    self._draw_page_number(c, width, height)
-                    c.showPage()
-                    self.page_number += 1
-                    if header_text:
-                        self._draw_header(c, width, height, header_text)
-                    c.setFont(self.font_name, font_size)
-                    y = top_margin
-                    first = True
-
-                indent = first_line_indent if first else 0
-                c.drawString(left_margin + indent, y, line)
+                    y = new_page()
+                    run = None
+                if run is None:
+                    run = [paragraph_index, line_index, 0, y]
+                    pages[-1]["runs"].append(run)
+                run[2] += 1
                 y -= line_height
-                first = False
 
             y -= line_height  # odstęp między akapitami
 
             # Ilustracja po akapicie
-            if illustrations and illustration_index < len(illustrations):
-                y = self._add_illustration(c, illustrations[illustration_index], y, width, height)
+            if illustration_index < illustration_count:
+                y = place_illustration(illustration_index, y)
                 illustration_index += 1
 
-        # Ilustracje na końcu
-        while illustrations and illustration_index < len(illustrations):
-            c.showPage()
-            self.page_number += 1
-            y = height - 60
-            y = self._add_illustration(c, illustrations[illustration_index], y, width, height)
+        # Ilustracje na końcu — każda od nowej strony
+        while illustration_index < illustration_count:
+            y = place_illustration(illustration_index, new_page())
             illustration_index += 1
 
-        self._draw_page_number(c, width, height)
+        for page in pages:
+            page["runs"] = [tuple(run) for run in page["runs"]]
+
+        return {
+            "page_size": (width, height),
+            "paragraphs": wrapped,
+            "headings": {i for i, p in enumerate(paragraphs) if self._is_heading(p)},
+            "pages": pages
+        }
+
+    def _is_heading(self, paragraph):
+        if HEADING_PATTERN.match(paragraph):
+            return True
+        return len(paragraph.split()) <= 6 and paragraph[-1] not in ".!?…:;,\"'”»-–—"
+
+    # -----------------------------
+    # TREŚĆ — rysowanie według indeksu stron (bez justowania)
+    # -----------------------------
+    def _draw_story_content(self, c, index, illustrations, title, page_offset=0):
+        width, height = index["page_size"]
+
+        for page in index["pages"]:
+            # page_offset — ciągła numeracja, gdy treść nie zaczyna się od strony 1 (antologia)
+            self.page_number = page["number"] + page_offset
+
+            # Nagłówek z tytułem (jeśli jest) zamiast "Opowiadanie"
+            if page["header"] and title:
+                self._draw_header(c, width, height, title)
+
+            glyphs = self._draw_page_text(c, page, index["paragraphs"])
+
+            for image_index, x, y, w, h in page["illustrations"]:
+                self._draw_image(c, illustrations[image_index], x, y, w, h)
+
+            self._draw_page_number(c, width, height)
+            self._end_page(c, glyphs)
+
+    def _draw_page_text(self, c, page, paragraphs):
+        """
+        Cała treść strony w jednym obiekcie tekstowym: czcionka i interlinia ustawione raz,
+        kolejne linie przez T*, a wcięcia i odstępy między akapitami przez względne Td.
+        Zwraca liczbę narysowanych znaków (bez spacji).
+        """
+        line_height = self.LINE_HEIGHT
+        text = c.beginText()
+        text.setFont(self.font_name, self.FONT_SIZE, leading=line_height)
+
+        glyphs = 0
+        cursor = None  # początek następnej linii po T*
+        for paragraph, first_line, count, y in page["runs"]:
+            lines = paragraphs[paragraph]
+            for offset in range(count):
+                line_index = first_line + offset
+                x = self.MARGIN + (self.FIRST_LINE_INDENT if line_index == 0 else 0)
+                line_y = y - offset * line_height
+
+                if cursor is None:
+                    text.setTextOrigin(x, line_y)
+                elif abs(cursor[0] - x) > 0.01 or abs(cursor[1] - line_y) > 0.01:
+                    text.moveCursor(x - cursor[0], cursor[1] - line_y)
+
+                text.textLine(lines[line_index])
+                glyphs += len(lines[line_index]) - lines[line_index].count(" ")
+                cursor = (x, line_y - line_height)
+
+        if cursor is not None:
+            c.drawText(text)
+        return glyphs
+
+    # -----------------------------
+    # KONIEC STRONY I STATYSTYKI
+    # -----------------------------
+    def _end_page(self, c, glyphs=0):
+        if self._page_stats is None:
+            c.showPage()
+            return
+
+        # Rozmiar strumienia treści strony po kompresji (tak jak zapisze go ReportLab);
+        # c._code to wewnętrzna lista operatorów bieżącej strony ReportLab — czytana tylko tutaj
+        content = "\n".join(c._code).encode("latin-1", "replace")
+        self._page_stats.append({
+            "page": len(self._page_stats) + 1,
+            "content_bytes": len(zlib.compress(content)),
+            "glyphs": glyphs
+        })
+        c.showPage()
+
+    def _export_stats(self, data):
+        # Osadzony podzbiór czcionki ma nazwę z sześcioliterowym prefiksem, np. "ABCDEF+DejaVuSans"
+        subset = re.search(rb"/BaseFont /[A-Z]{6}\+" + self.font_name.encode(), data) is not None
+        return {
+            "pages": self._page_stats,
+            "page_count": len(self._page_stats),
+            "file_bytes": len(data),
+            "content_bytes": sum(p["content_bytes"] for p in self._page_stats),
+            "glyphs": sum(p["glyphs"] for p in self._page_stats),
+            "font": self.font_name,
+            "font_subset": subset
+        }
 
     # -----------------------------
     # NAGŁÓWEK
@@ -176,42 +455,45 @@ class PDFGenerator:
     # ZAWIJANIE TEKSTU PO SZEROKOŚCI STRONY
     # -----------------------------
     def _wrap_paragraph(self, paragraph, font_size, max_width):
-        words = paragraph.split()
-        lines = []
-        current_line = ""
-
-        for word in words:
-            test_line = word if not current_line else current_line + " " + word
-            line_width = pdfmetrics.stringWidth(test_line, self.font_name, font_size)
-
-            if line_width <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-
-        if current_line:
-            lines.append(current_line)
-
+        measurer = reportlab_measurer(self.font_name)
+        if self.line_breaking == "optimal":
+            return wrap_optimal(paragraph, measurer, font_size, max_width)
+        lines, _ = wrap_words(paragraph, measurer, font_size, max_width)
         return lines
 
     # -----------------------------
-    # ILUSTRACJE — czyste strony
+    # OBRAZY — profil eksportu i wspólne obiekty
     # -----------------------------
-    def _add_illustration(self, c, img, y, width, height):
-
-        if y < 450:
-            c.showPage()
-            self.page_number += 1
-            y = height - 60
-
-        temp_image_path = os.path.join(tempfile.gettempdir(), 'temp_img.jpg')
-
-        img_resized = img.copy().resize((400, 400))
-        img_resized.save(temp_image_path)
-
-        c.drawImage(temp_image_path, 100, y - 400)
-        os.remove(temp_image_path)
-
-        return y - 420
\ No newline at end of file
+    def _draw_image(self, c, img, x, y, w, h):
+        c.drawImage(self._image_reader(self._export_bytes(img, w, h)), x, y, w, h)
+
+    def _export_bytes(self, img, w, h):
+        """
+        JPEG dopasowany do profilu: zmniejszony raz do rozdzielczości, w jakiej obraz
+        będzie rysowany. Gdy obraz nie jest większy niż trzeba, a ma już bajty JPEG,
+        trafiają one do PDF bez ponownego kodowania.
+        """
+        if self.profile is None:
+            return encoded_bytes(img, "JPEG")
+
+        dpi = self.profile["dpi"]
+        target = (round(w / 72 * dpi), round(h / 72 * dpi))
+        if target[0] >= img.size[0] or target[1] >= img.size[1]:
+            if encoded_format(img) == "JPEG":
+                return encoded_bytes(img, "JPEG")
+            target = img.size
+
+        return resampled_bytes(
+            img, target,
+            quality=self.profile["quality"],
+            progressive=self.profile["progressive"],
+            subsampling=self.profile["subsampling"]
+        )
+
+    def _image_reader(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        reader = self._readers.get(digest)
+        if reader is None:
+            reader = ImageReader(io.BytesIO(data))
+            self._readers[digest] = reader
+        return reader
@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class StoryPipeline:
+    """Uruchamia równolegle zadania zależne od gotowego opowiadania"""
+
+    def __init__(self, generator, max_workers=6, illustration_workers=4):
+        self.generator = generator
+        self.max_workers = max_workers
+        # Osobny limit równoległych zapytań o ilustracje
+        self._illustration_slots = threading.BoundedSemaphore(max(1, illustration_workers))
+
+    # -----------------------------
+    # URUCHOMIENIE WSZYSTKICH ZADAŃ
+    # -----------------------------
+    def run(self, story_text, params, on_job_done=None, package=None):
+        """
+        Startuje jednocześnie: tytuły, okładkę i N ilustracji.
+        Błąd jednego zadania nie przerywa pozostałych.
+        on_job_done(nazwa, wynik, błąd) wywoływane jest w wątku głównym.
+        package — wynik generate_story(structured=True); gotowe tytuły, sceny
+        i opis okładki nie wymagają wtedy osobnych zapytań.
+        """
+        jobs = self._build_jobs(story_text, params, package or {})
+
+        results = {}
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(func, *args): name
+                for name, (func, args) in jobs.items()
+            }
+
+            for future in as_completed(futures):
+                name = futures[future]
+                result = None
+                error = None
+
+                try:
+                    result = future.result()
+                    results[name] = result
+                except Exception as e:
+                    error = e
+                    errors[name] = e
+
+                if on_job_done:
+                    on_job_done(name, result, error)
+
+        illustrations = [
+            results.get(name)
+            for name in sorted(n for n in jobs if n.startswith("illustration_"))
+            if results.get(name) is not None
+        ]
+
+        return {
+            "titles": (package or {}).get("titles") or results.get("titles", []),
+            "cover": results.get("cover"),
+            "illustrations": illustrations,
+            "errors": errors
+        }
+
+    # -----------------------------
+    # LISTA ZADAŃ
+    # -----------------------------
+    def _build_jobs(self, story_text, params, package):
+        jobs = {}
+
+        if not package.get("titles"):
+            jobs["titles"] = (self.generator.generate_title_suggestions, (story_text,))
+
+        if params.get("cover_sketch"):
+            description = params.get("cover_description") or package.get("cover_prompt", "")
+            jobs["cover"] = (
+                self.generator.generate_cover,
+                (params["cover_sketch"], description, params["illustration_style"],
+                 params.get("cover_variants", 1))
+            )
+
+        scenes = package.get("scenes")
+        if not scenes:
+            scenes = self.generator.extract_scenes(story_text, params.get("num_illustrations", 0))
+        for idx, scene in enumerate(scenes):
+            jobs[f"illustration_{idx:02d}"] = (
+                self._illustrate,
+                (scene, params["illustration_style"])
+            )
+
+        return jobs
+
+    def _illustrate(self, scene, style):
+        with self._illustration_slots:
+            return self.generator.illustrate_scene(scene, style)
@@ -0,0 +1,184 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache import CACHE_DIR
+
+# Słownik ryzykownych słów: (wzorzec form odmiany, neutralny zamiennik, waga)
+# Wzorce obejmują formy fleksyjne, np. krew / krwi / krwią. Polskie wzorce mają zamknięte
+# listy końcówek tam, gdzie temat jest też angielskim słowem (walk-, tortur-), żeby
+# angielskie opisy scen ("walking", "torture") nie dostawały polskich zamienników.
+LEXICON = [
+    # --- polski ---
+    (r"krew|krwi|krwią", "czerwień", 2),
+    (r"krwaw\w*|zakrwawi\w*", "czerwony", 2),
+    (r"śmier[cć]\w*", "koniec", 2),
+    (r"zabi(?:ć|ł\w*|j\w*|t\w*|ci\w*)|zabój\w*|zabójc\w*", "pokonać", 3),
+    (r"morder\w*|morduj\w*|zamordow\w*", "tajemnica", 3),
+    (r"przemoc\w*|brutaln\w*", "konflikt", 2),
+    (r"broń|broni|bronią|broniach", "narzędzie", 1),
+    (r"walk(?:a|i|ę|ą|o|om|ach|ami)|walce|walcz\w*", "pojedynek", 1),
+    (r"trup\w*|zwłok\w*", "cień", 3),
+    (r"nóż|noża|nożem|noże|noży\w*", "narzędzie", 2),
+    (r"pistolet\w*|karabin\w*|rewolwer\w*", "przedmiot", 3),
+    (r"strzel\w*|postrzel\w*", "celować", 2),
+    (r"ran[aąęy]|rann\w*|zrani\w*", "zadrapanie", 1),
+    (r"tortur(?:a|y|ę|ą|o|om|ach|ami|owa\w*|uj\w*)", "próba", 4),
+    (r"samobój\w*", "smutek", 6),
+    # --- angielski (opisy scen i okładek) ---
+    (r"blood\w*", "red", 2),
+    (r"kill\w*|slay\w*|slain", "defeat", 3),
+    (r"dead|death\w*|dying", "ending", 2),
+    (r"murder\w*", "mystery", 3),
+    (r"violen\w*|brutal\w*", "conflict", 2),
+    (r"weapons?|guns?|pistols?|rifles?", "tool", 2),
+    (r"knife|knives", "tool", 2),
+    (r"corpses?", "shadow", 3),
+    # Samo "wound" to też czas przeszły "wind" ("the path wound through the hills")
+    (r"wound(?:s|ed|ing)|injur\w*", "scratch", 1),
+    (r"tortur\w*", "trial", 4),
+    (r"suicid\w*", "sadness", 6),
+]
+
+# Od tego wyniku prompt uznajemy za zbyt ryzykowny i od razu używamy promptu zastępczego
+BLOCK_THRESHOLD = 6
+
+
+class PromptScreener:
+    """
+    Lokalna kontrola promptu przed wywołaniem API obrazów.
+    Wszystkie wzorce są złożone w jedno wyrażenie regularne (jeden przebieg po tekście);
+    nazwana grupa trafienia wskazuje wpis słownika.
+    """
+
+    def __init__(self, lexicon=None, block_threshold=BLOCK_THRESHOLD):
+        self.lexicon = lexicon or LEXICON
+        self.block_threshold = block_threshold
+        self._pattern = re.compile(
+            "|".join(
+                rf"(?P<t{idx}>\b(?:{pattern})\b)"
+                for idx, (pattern, _, _) in enumerate(self.lexicon)
+            ),
+            re.IGNORECASE
+        )
+
+    def screen(self, text):
+        """
+        Zwraca słownik:
+        text — prompt z zamienionymi ryzykownymi słowami,
+        score — suma wag trafień,
+        terms — dopasowane słowa,
+        blocked — czy lepiej od razu użyć ogólnego promptu zastępczego.
+        """
+        terms = []
+        score = 0
+
+        def replace(match):
+            nonlocal score
+            _, replacement, weight = self.lexicon[int(match.lastgroup[1:])]
+            terms.append(match.group().lower())
+            score += weight
+            return replacement
+
+        rewritten = self._pattern.sub(replace, text)
+
+        return {
+            "text": rewritten,
+            "score": score,
+            "terms": terms,
+            "blocked": score >= self.block_threshold
+        }
+
+
+class ScreeningLog:
+    """
+    Zapisuje wyniki moderacji do strojenia słownika. Dla słowa ze słownika wysłanego bez zmian:
+    blocked / passed — prompt zablokowany / przepuszczony; dla słowa zamienionego przed
+    wysłaniem: rewritten_blocked / rewritten — wynik promptu z zamiennikiem.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS terms "
+            "(term TEXT PRIMARY KEY, blocked INTEGER, passed INTEGER, "
+            "rewritten INTEGER DEFAULT 0, rewritten_blocked INTEGER DEFAULT 0)"
+        )
+        # Starsze bazy nie mają kolumn dla zamienionych słów
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(terms)")]
+        for column in ("rewritten", "rewritten_blocked"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE terms ADD COLUMN {column} INTEGER DEFAULT 0")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prompts (prompt TEXT, score INTEGER, blocked INTEGER, created REAL)"
+        )
+        self._conn.commit()
+
+    def record(self, prompt, screening, blocked):
+        """prompt — tekst faktycznie wysłany do API (po zamianie słów)"""
+        sent = prompt.lower()
+        sent_terms = set()
+        with self._lock:
+            for term in set(screening["terms"]):
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO terms (term, blocked, passed) VALUES (?, 0, 0)", (term,)
+                )
+                if re.search(rf"\b{re.escape(term)}\b", sent):
+                    sent_terms.add(term)
+                    column = "blocked" if blocked else "passed"
+                else:
+                    # Do API trafił zamiennik, nie samo słowo
+                    column = "rewritten_blocked" if blocked else "rewritten"
+                self._conn.execute(f"UPDATE terms SET {column} = {column} + 1 WHERE term = ?", (term,))
+
+            # Zablokowane prompty bez wysłanych słów ze słownika to kandydaci na nowe wpisy
+            if blocked and not sent_terms:
+                self._conn.execute(
+                    "INSERT INTO prompts (prompt, score, blocked, created) VALUES (?, ?, 1, ?)",
+                    (prompt[:500], screening["score"], time.time())
+                )
+            self._conn.commit()
+
+    def term_stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT term, blocked, passed, rewritten, rewritten_blocked FROM terms "
+                "ORDER BY blocked DESC, passed ASC"
+            ).fetchall()
+        return [
+            {"term": t, "blocked": b, "passed": p, "rewritten": r, "rewritten_blocked": rb}
+            for t, b, p, r, rb in rows
+        ]
+
+    def unmatched_blocked(self, limit=50):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT prompt FROM prompts ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+_screener = PromptScreener()
+_log = None
+_log_lock = threading.Lock()
+
+
+def screen_prompt(text):
+    return _screener.screen(text)
+
+
+def get_screening_log():
+    """Współdzielony dziennik wyników moderacji (None, jeśli katalog niedostępny)"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            try:
+                _log = ScreeningLog(os.path.join(CACHE_DIR, "screening.sqlite"))
+            except Exception as e:
+                print(f"⚠️ Dziennik moderacji niedostępny ({e}) — działam bez niego.")
+                _log = False
+        return _log or None
@@ -0,0 +1,281 @@
+import random
+import re
+import threading
+import time
+
+import openai
+
+# Domyślne limity równoległych zapytań na rodzaj endpointu
+DEFAULT_CONCURRENCY = {
+    "chat": 8,
+    "images": 4,
+    "speech": 4
+}
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError
+)
+
+
+class TokenBucket:
+    """Kubełek żetonów — rozkłada zapytania w czasie zgodnie z limitem konta"""
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = rate  # żetony na sekundę (None = bez limitu)
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blokuje do momentu, aż dostępny będzie żeton"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self.paused_until - now
+
+                if delay <= 0 and self.rate is None:
+                    return
+
+                if delay <= 0:
+                    self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+
+    def update(self, limit, remaining, reset_seconds):
+        """Dostosowuje tempo do nagłówków x-ratelimit-* z odpowiedzi API"""
+        with self._lock:
+            if limit:
+                self.capacity = limit
+                self.rate = limit / 60.0  # limity OpenAI są na minutę
+                self.tokens = min(self.tokens if self.tokens is not None else limit, remaining)
+                self._updated = time.monotonic()
+            if remaining == 0 and reset_seconds:
+                self.paused_until = max(self.paused_until, time.monotonic() + reset_seconds)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """
+    Wspólny harmonogram wszystkich zapytań do modeli:
+    limity równoległości per endpoint, tempo z nagłówków rate-limit,
+    ponawianie z wykładniczym opóźnieniem (z losowym rozrzutem) i obsługą Retry-After.
+    """
+
+    def __init__(self, concurrency=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._slots = {name: threading.BoundedSemaphore(n) for name, n in self.concurrency.items()}
+        self._buckets = {name: TokenBucket() for name in self.concurrency}
+        self._lock = threading.Lock()
+        self._metrics = {name: self._empty_metrics() for name in self.concurrency}
+
+    # -----------------------------
+    # WYKONANIE ZAPYTANIA
+    # -----------------------------
+    def call(self, endpoint, func, *args, **kwargs):
+        """
+        Wykonuje func(*args, **kwargs) w ramach limitów endpointu.
+        Jeśli func zwraca surową odpowiedź (with_raw_response), odczytuje
+        nagłówki rate-limit i zwraca sparsowany wynik.
+        """
+        slots = self._slots[endpoint]
+        bucket = self._buckets[endpoint]
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            self._record(endpoint, queued=1)
+            error = None
+
+            with slots:
+                bucket.acquire()
+                self._record(endpoint, queued=-1, running=1, waited=time.monotonic() - queued_at)
+                try:
+                    result = func(*args, **kwargs)
+                except RETRYABLE_ERRORS as e:
+                    error = e
+                except Exception:
+                    self._record(endpoint, running=-1, failures=1)
+                    raise
+
+            if error is None:
+                self._record(endpoint, running=-1, requests=1)
+                if hasattr(result, "headers") and hasattr(result, "parse"):
+                    self._update_bucket(bucket, result.headers)
+                    return result.parse()
+                return result
+
+            # Błąd przejściowy — czekamy poza slotem, żeby nie blokować innych zapytań
+            self._record(endpoint, running=-1, failures=1)
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._retry_delay(error, attempt)
+            if isinstance(error, openai.RateLimitError):
+                bucket.pause(delay)
+            self._record(endpoint, retries=1)
+            time.sleep(delay)
+
+    def stream(self, endpoint, func, *args, resume=None, **kwargs):
+        """
+        Jak call, ale dla odpowiedzi strumieniowej: generator kolejnych elementów strumienia.
+        Slot endpointu jest zajęty aż do końca strumienia (albo zamknięcia generatora).
+        Błąd przejściowy przed pierwszym elementem ponawia to samo zapytanie; po nim —
+        zapytanie z argumentami z resume(kwargs) (kontynuacja), a bez resume błąd jest zgłaszany.
+        """
+        slots = self._slots[endpoint]
+        bucket = self._buckets[endpoint]
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            self._record(endpoint, queued=1)
+            error = None
+            delivered = False
+
+            with slots:
+                bucket.acquire()
+                self._record(endpoint, queued=-1, running=1, waited=time.monotonic() - queued_at)
+                try:
+                    response = func(*args, **kwargs)
+                    if hasattr(response, "headers") and hasattr(response, "parse"):
+                        self._update_bucket(bucket, response.headers)
+                        response = response.parse()
+                    for item in response:
+                        delivered = True
+                        yield item
+                except RETRYABLE_ERRORS as e:
+                    error = e
+                except GeneratorExit:
+                    # Wywołujący przerwał odczyt — zwalniamy slot bez liczenia błędu
+                    self._record(endpoint, running=-1)
+                    raise
+                except Exception:
+                    self._record(endpoint, running=-1, failures=1)
+                    raise
+
+            if error is None:
+                self._record(endpoint, running=-1, requests=1)
+                return
+
+            self._record(endpoint, running=-1, failures=1)
+            if attempt >= self.max_retries or (delivered and resume is None):
+                raise error
+            if delivered:
+                kwargs = resume(kwargs)
+            delay = self._retry_delay(error, attempt)
+            if isinstance(error, openai.RateLimitError):
+                bucket.pause(delay)
+            self._record(endpoint, retries=1)
+            time.sleep(delay)
+
+    def _retry_delay(self, error, attempt):
+        """Retry-After z odpowiedzi albo wykładnicze opóźnienie z pełnym rozrzutem"""
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+
+        retry_after = headers.get("retry-after-ms")
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after) / 1000.0)
+            except ValueError:
+                pass
+
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _update_bucket(self, bucket, headers):
+        try:
+            limit = int(headers.get("x-ratelimit-limit-requests", 0))
+            remaining = int(headers.get("x-ratelimit-remaining-requests", limit))
+        except ValueError:
+            return
+        reset = _parse_duration(headers.get("x-ratelimit-reset-requests", ""))
+        bucket.update(limit, remaining, reset)
+
+    # -----------------------------
+    # METRYKI
+    # -----------------------------
+    @staticmethod
+    def _empty_metrics():
+        return {
+            "queued": 0,
+            "running": 0,
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+            "waits": 0
+        }
+
+    def _record(self, endpoint, queued=0, running=0, requests=0, retries=0, failures=0, waited=None):
+        with self._lock:
+            m = self._metrics[endpoint]
+            m["queued"] += queued
+            m["running"] += running
+            m["requests"] += requests
+            m["retries"] += retries
+            m["failures"] += failures
+            if waited is not None:
+                m["total_wait"] += waited
+                m["max_wait"] = max(m["max_wait"], waited)
+                m["waits"] += 1
+
+    def metrics(self):
+        """Głębokość kolejki, zapytania w toku i czasy oczekiwania per endpoint"""
+        with self._lock:
+            report = {}
+            for name, m in self._metrics.items():
+                report[name] = {
+                    "limit": self.concurrency[name],
+                    "queue_depth": m["queued"],
+                    "in_flight": m["running"],
+                    "requests": m["requests"],
+                    "retries": m["retries"],
+                    "failures": m["failures"],
+                    "avg_wait": m["total_wait"] / m["waits"] if m["waits"] else 0.0,
+                    "max_wait": m["max_wait"]
+                }
+            return report
+
+
+def _parse_duration(value):
+    """Zamienia czas w formacie OpenAI ('1s', '6m0s', '20ms') na sekundy"""
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value or ""):
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key):
+    """Wspólny harmonogram dla danego klucza API (limity dotyczą konta)"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(api_key)
+        if scheduler is None:
+            scheduler = RequestScheduler()
+            _schedulers[api_key] = scheduler
+        return scheduler
@@ -1,19 +1,355 @@
-import openai
 import base64
+import difflib
+import hashlib
 import io
+import json
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import openai
 from PIL import Image
 
+from cache import get_completion_cache, get_image_cache
+from image_utils import attach_encoded, encoded_bytes, encoded_format
+from openai_client import get_client
+from prompt_screening import get_screening_log, screen_prompt
+from scheduler import get_scheduler
+from title_layers import compose_title, prerender_title_layers
+
+# Schemat odpowiedzi JSON: opowiadanie, tytuły, sceny do ilustracji i opis okładki
+STORY_PACKAGE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "story_package",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "story": {"type": "string"},
+                "titles": {"type": "array", "items": {"type": "string"}},
+                "scenes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "quote": {"type": "string"},
+                            "description": {"type": "string"}
+                        },
+                        "required": ["quote", "description"],
+                        "additionalProperties": False
+                    }
+                },
+                "cover_prompt": {"type": "string"}
+            },
+            "required": ["story", "titles", "scenes", "cover_prompt"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+# Schemat planu długiego opowiadania: stała obsada i streszczenia części
+OUTLINE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "story_outline",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "cast": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "description": {"type": "string"}
+                        },
+                        "required": ["name", "description"],
+                        "additionalProperties": False
+                    }
+                },
+                "sections": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "title": {"type": "string"},
+                            "summary": {"type": "string"}
+                        },
+                        "required": ["title", "summary"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["cast", "sections"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+# Schemat wyboru akapitów do modyfikacji przyrostowej
+PARAGRAPHS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "affected_paragraphs",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "paragraphs": {"type": "array", "items": {"type": "integer"}}
+            },
+            "required": ["paragraphs"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def _partial_json_string(raw, key):
+    """Odczytuje (być może niedokończoną) wartość tekstową pola z częściowego JSON"""
+    match = re.search(r'"%s"\s*:\s*"' % re.escape(key), raw)
+    if not match:
+        return ""
+
+    content = raw[match.end():]
+    end = re.search(r'(?<!\\)(?:\\\\)*"', content)
+    if end:
+        content = content[:end.end() - 1]
+    else:
+        # Odetnij niedokończoną sekwencję ucieczki na końcu
+        if (len(content) - len(content.rstrip("\\"))) % 2:
+            content = content[:-1]
+        content = re.sub(r'\\u[0-9a-fA-F]{0,3}$', "", content)
+        content = re.sub(r'\\u[dD][89abAB][0-9a-fA-F]{2}$', "", content)
+
+    try:
+        return json.loads('"' + content + '"')
+    except ValueError:
+        return ""
+
+
+# Jakość obrazów: szkice do podglądu i wersje finalne do eksportu
+DEFAULT_QUALITY = "auto"
+DRAFT_QUALITY = "low"
+FINAL_QUALITY = "high"
+
+# Percentyl czasu generowania obrazu, po którym startuje zapasowe zapytanie
+HEDGE_PERCENTILE = 90
+
+
+class LatencyTracker:
+    """Ostatnie czasy odpowiedzi API obrazów (wspólne dla procesu)"""
+
+    def __init__(self, size=50, min_samples=5):
+        self._samples = deque(maxlen=size)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+_image_latencies = LatencyTracker()
+
+
 class StoryGenerator:
-    def __init__(self, api_key, model="gpt-4o-mini"):
+    def __init__(self, api_key, model="gpt-4o-mini", client=None, cache=None, reuse_responses=False,
+                 image_cache=None, scheduler=None, hedge_images=False, draft_images=False,
+                 image_format="jpeg", image_compression=85):
         self.api_key = api_key
         self.model = model
-        self.client = openai.OpenAI(api_key=api_key)
+        # Współdzielony klient z pulą połączeń (keep-alive między akcjami)
+        self.client = client or get_client(api_key)
+        # Wszystkie zapytania przechodzą przez wspólny harmonogram (limity, ponawianie)
+        self.scheduler = scheduler or get_scheduler(api_key)
+        # Odpowiedzi deterministyczne (temperatura 0) są zawsze zapamiętywane,
+        # twórcze (wysoka temperatura) — tylko gdy reuse_responses=True
+        self.cache = cache if cache is not None else get_completion_cache()
+        self.reuse_responses = reuse_responses
+        self.image_cache = image_cache if image_cache is not None else get_image_cache()
+        # Szkice: szybkie obrazy niskiej jakości do podglądu, wersje finalne przy eksporcie
+        self.image_quality = DRAFT_QUALITY if draft_images else DEFAULT_QUALITY
+        # Format przesyłu obrazów: skompresowany JPEG/WebP zamiast dużego PNG
+        self.image_format = image_format
+        self.image_compression = image_compression
+        # Zapasowe zapytanie, gdy obraz spóźnia się ponad typowy czas (HEDGE_PERCENTILE)
+        self.hedge_images = hedge_images
+        # Pakiet z ostatniego generate_story_stream(structured=True)
+        self.story_package = None
 
     # ---------------------------------------------------------
     # GENEROWANIE OPOWIADANIA
     # ---------------------------------------------------------
-    def generate_story(self, params):
-        prompt = (
+    def generate_story(self, params, structured=False):
+        """
+        Zwraca tekst opowiadania. Z structured=True zwraca słownik
+        {"story", "titles", "scenes", "cover_prompt"} z jednego zapytania.
+        """
+        if structured:
+            prompt = self._build_package_prompt(params)
+            try:
+                raw = self._complete(
+                    "story_package", prompt, temperature=0.9,
+                    response_format=STORY_PACKAGE_FORMAT
+                )
+            except openai.BadRequestError:
+                raw = ""
+
+            package = self._parse_package(raw, params)
+            if package is None:
+                # Model nie zwrócił poprawnego JSON — zwykła ścieżka tekstowa
+                package = self._fallback_package(self.generate_story(params), params)
+            return package
+
+        prompt = self._build_story_prompt(params)
+        return self._complete("story", prompt, temperature=0.9)
+
+    # ---------------------------------------------------------
+    # GENEROWANIE OPOWIADANIA — STRUMIENIOWO
+    # ---------------------------------------------------------
+    def generate_story_stream(self, params, structured=False):
+        """
+        Zwraca generator kolejnych fragmentów tekstu w miarę ich nadchodzenia.
+        Z structured=True strumieniowany jest tekst z pola "story" odpowiedzi JSON,
+        a po wyczerpaniu generatora pełny pakiet jest w self.story_package.
+        """
+        if not structured:
+            yield from self._stream_chat("story", self._build_story_prompt(params), 0.9)
+            return
+
+        raw = ""
+        story = ""
+        try:
+            for delta in self._stream_chat(
+                "story_package", self._build_package_prompt(params), 0.9,
+                response_format=STORY_PACKAGE_FORMAT
+            ):
+                raw += delta
+                current = _partial_json_string(raw, "story")
+                if len(current) > len(story):
+                    yield current[len(story):]
+                    story = current
+        except openai.BadRequestError:
+            # Model nie obsługuje odpowiedzi JSON — zwykły strumień tekstu
+            for delta in self._stream_chat("story", self._build_story_prompt(params), 0.9):
+                story += delta
+                yield delta
+
+        self.story_package = self._parse_package(raw, params) or self._fallback_package(story, params)
+
+    def _stream_chat(self, kind, prompt, temperature, response_format=None):
+        cached = self._cache_get(kind, prompt, temperature)
+        if cached is not None:
+            yield cached
+            return
+
+        messages = [{"role": "user", "content": prompt}]
+        parts = []
+
+        def resume(kwargs):
+            # Strumień przerwany w połowie — model dopisuje ciąg dalszy już wysłanego tekstu
+            kwargs = dict(kwargs, messages=messages + [
+                {"role": "assistant", "content": "".join(parts)},
+                {"role": "user", "content": "Kontynuuj dokładnie od miejsca przerwania, bez powtarzania tekstu."}
+            ])
+            # Kontynuacja nie jest osobnym obiektem JSON
+            kwargs.pop("response_format", None)
+            return kwargs
+
+        extra = {"response_format": response_format} if response_format else {}
+        # Slot "chat" jest zajęty przez cały strumień, nie tylko do nagłówków odpowiedzi
+        stream = self.scheduler.stream(
+            "chat",
+            self.client.chat.completions.with_raw_response.create,
+            resume=resume,
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            **extra
+        )
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        self._cache_set(kind, prompt, temperature, "".join(parts))
+
+    # ---------------------------------------------------------
+    # PAKIET: OPOWIADANIE + TYTUŁY + SCENY + OPIS OKŁADKI
+    # ---------------------------------------------------------
+    def _build_package_prompt(self, params):
+        num_scenes = max(1, params.get("num_illustrations") or 1)
+        return (
+            self._build_story_prompt(params)
+            + "\nZwróć wynik jako JSON:\n"
+            "- story: pełny tekst opowiadania (akapity oddzielone pustą linią),\n"
+            "- titles: 5 krótkich, chwytliwych tytułów (maksymalnie 5 słów, bez numeracji),\n"
+            f"- scenes: {num_scenes} kluczowych scen równomiernie rozłożonych w opowiadaniu; "
+            "quote to dokładny cytat (jedno zdanie) z tekstu sceny, "
+            "description to krótki, bezpieczny opis wizualny sceny po angielsku,\n"
+            "- cover_prompt: krótki opis okładki po angielsku (bez tekstu na obrazie).\n"
+        )
+
+    def _parse_package(self, raw, params):
+        try:
+            data = json.loads(raw)
+            story = data["story"].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if not story:
+            return None
+
+        scenes = []
+        for scene in (data.get("scenes") or [])[:params.get("num_illustrations", 0)]:
+            quote = (scene.get("quote") or "").strip()
+            offset = story.find(quote) if quote else -1
+            scenes.append({
+                "text": scene.get("description") or quote,
+                "offset": offset if offset >= 0 else None
+            })
+
+        # Cytat niedosłowny albo pusty — pozycję sceny bierzemy z lokalnego wyboru scen
+        if any(scene["offset"] is None for scene in scenes):
+            local = self.extract_scenes(story, len(scenes))
+            for idx, scene in enumerate(scenes):
+                if scene["offset"] is None and idx < len(local):
+                    scene["offset"] = local[idx]["offset"]
+
+        return {
+            "story": story,
+            "titles": self._clean_titles(data.get("titles") or [])
+                      or self.generate_title_suggestions(story),
+            "scenes": scenes,
+            "cover_prompt": (data.get("cover_prompt") or "").strip()
+        }
+
+    def _fallback_package(self, story, params):
+        return {
+            "story": story,
+            "titles": self.generate_title_suggestions(story),
+            "scenes": self.extract_scenes(story, params.get("num_illustrations", 0)),
+            "cover_prompt": ""
+        }
+
+    def _build_story_prompt(self, params):
+        return (
             f"Napisz opowiadanie o długości około {params['word_count']} słów.\n"
             f"Grupa wiekowa: {params['age_group']}.\n"
             f"Gatunek: {params['genre']}.\n"
@@ -25,13 +361,84 @@ class StoryGenerator:
             f"Unikaj wulgaryzmów i treści nieodpowiednich.\n"
         )
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.9
+    # ---------------------------------------------------------
+    # DŁUGA FORMA — PLAN, POTEM RÓWNOLEGŁE CZĘŚCI
+    # ---------------------------------------------------------
+    def generate_long_story(self, params, section_words=600, max_workers=6, on_section=None):
+        """
+        Najpierw krótki plan ze stałą obsadą, potem wszystkie części równolegle
+        (każda z planem i streszczeniami sąsiednich części), sklejone w kolejności.
+        on_section(indeks, tekst, liczba_części) wywoływane po ukończeniu każdej części.
+        """
+        count = max(2, round(params["word_count"] / section_words))
+        outline = self.generate_outline(params, count)
+        if outline is None:
+            # Brak planu — zwykłe generowanie jednym zapytaniem
+            return self.generate_story(params)
+
+        sections = outline["sections"]
+        words_per_section = round(params["word_count"] / len(sections))
+        texts = [None] * len(sections)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {
+                pool.submit(self._write_section, params, outline, idx, words_per_section): idx
+                for idx in range(len(sections))
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                texts[idx] = future.result().strip()
+                if on_section:
+                    on_section(idx, texts[idx], len(sections))
+
+        return "\n\n".join(texts)
+
+    def generate_outline(self, params, count):
+        """Plan opowiadania: obsada i `count` części ze streszczeniami"""
+        prompt = (
+            self._build_story_prompt(params)
+            + f"\nNie pisz jeszcze opowiadania. Przygotuj plan w {count} częściach.\n"
+            "cast: wszyscy bohaterowie (imię i krótki, stały opis) — tylko podani powyżej "
+            "oraz ewentualnie postacie epizodyczne,\n"
+            "sections: dla każdej części tytuł roboczy i streszczenie w 2–3 zdaniach; "
+            "części razem tworzą pełną fabułę z zadanym zakończeniem.\n"
         )
 
-        return response.choices[0].message.content
+        try:
+            data = json.loads(self._complete("outline", prompt, temperature=0.7, response_format=OUTLINE_FORMAT))
+            sections = [s for s in data["sections"] if s.get("summary")]
+        except (ValueError, KeyError, TypeError, openai.BadRequestError):
+            return None
+
+        if len(sections) < 2:
+            return None
+        return {"cast": data.get("cast") or [], "sections": sections}
+
+    def _write_section(self, params, outline, idx, words):
+        sections = outline["sections"]
+        cast = "\n".join(f"- {c['name']}: {c['description']}" for c in outline["cast"])
+        plan = "\n".join(
+            f"{i + 1}. {s['title']} — {s['summary']}" for i, s in enumerate(sections)
+        )
+        previous = sections[idx - 1]["summary"] if idx > 0 else "brak (to początek opowiadania)"
+        following = sections[idx + 1]["summary"] if idx + 1 < len(sections) else "brak (to zakończenie)"
+
+        prompt = (
+            f"Piszesz część {idx + 1} z {len(sections)} opowiadania.\n"
+            f"Grupa wiekowa: {params['age_group']}. Gatunek: {params['genre']}.\n"
+            f"Zakończenie całości: {params['ending_type']} – {params['ending_mood']}.\n"
+            f"Obsada (nie zmieniaj imion ani cech):\n{cast}\n\n"
+            f"Plan całości:\n{plan}\n\n"
+            f"Poprzednia część: {previous}\n"
+            f"Następna część: {following}\n\n"
+            f"Napisz wyłącznie część {idx + 1} ({sections[idx]['title']}), około {words} słów. "
+            "Nie dodawaj tytułu ani numeru części, nie streszczaj innych części. "
+            "Zacznij płynnie tam, gdzie kończy się poprzednia część, i zakończ tak, "
+            "by następna mogła bezpośrednio kontynuować.\n"
+            "Styl narracji: płynny, obrazowy, emocjonalny. Unikaj wulgaryzmów i treści nieodpowiednich.\n"
+        )
+
+        return self._complete("section", prompt, temperature=0.9)
 
     # ---------------------------------------------------------
     # GENEROWANIE TYTUŁÓW - POPRAWIONA WERSJA
@@ -45,14 +452,10 @@ class StoryGenerator:
             f"{story_text}"
         )
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.8
-        )
+        titles = self._complete("titles", prompt, temperature=0.8).split("\n")
+        return self._clean_titles(titles)
 
-        titles = response.choices[0].message.content.split("\n")
-        
+    def _clean_titles(self, titles):
         # POPRAWKA: Czyszczenie tytułów z numeracji i znaków
         cleaned_titles = []
         for t in titles:
@@ -69,9 +472,19 @@ class StoryGenerator:
     # ---------------------------------------------------------
     # ILUSTRACJE — GPT-IMAGE-1 (z bezpieczniejszym promptem)
     # ---------------------------------------------------------
-    def generate_illustration(self, fragment, style):
+    def generate_illustration(self, fragment, style, variants=1, fresh=False):
+        """
+        Ilustracja fragmentu. Przy variants > 1 zwraca listę wariantów
+        wygenerowanych jednym zapytaniem — do wyboru przez użytkownika.
+        fresh=True — nowe obrazy z API zamiast zapamiętanych (ponowne generowanie na żądanie).
+        """
+        # Lokalna kontrola przed zapytaniem — zbyt ryzykowny fragment od razu zastępujemy
+        screening = screen_prompt(fragment)
+        if screening["blocked"]:
+            return self._as_variants(self._generate_generic_illustration(style), variants)
+
         # Skróć i uogólnij fragment do 200 znaków
-        safe_fragment = self._sanitize_prompt(fragment, max_length=200)
+        safe_fragment = self._sanitize_prompt(screening["text"], max_length=200)
         
         prompt = (
             f"A beautiful {style.lower()} style illustration depicting: {safe_fragment}. "
@@ -79,30 +492,93 @@ class StoryGenerator:
         )
 
         try:
-            response = self.client.images.generate(
-                model="gpt-image-1",
-                prompt=prompt,
-                size="1024x1024"
-            )
-
-            if not response or not response.data or not response.data[0].b64_json:
-                return None
-
-            image_bytes = base64.b64decode(response.data[0].b64_json)
-            return Image.open(io.BytesIO(image_bytes))
+            return self._generate_variants(prompt, style, variants, screening, fresh=fresh)
         
         except Exception as e:
             # Jeśli nadal blokuje, spróbuj ogólniejszego promptu
             if "moderation" in str(e).lower():
-                return self._generate_generic_illustration(style)
+                return self._as_variants(self._generate_generic_illustration(style), variants)
             raise e
 
+    # ---------------------------------------------------------
+    # AUTOMATYCZNE ILUSTRACJE — WYBÓR SCEN I GENEROWANIE WSADOWE
+    # ---------------------------------------------------------
+    def extract_scenes(self, story_text, count):
+        """
+        Dzieli opowiadanie na `count` równych części i z każdej wybiera
+        kluczowy akapit. Zwraca listę słowników {"text", "offset"}, gdzie
+        offset to pozycja znaku początku sceny w story_text.
+        """
+        paragraphs = [
+            (m.start(), m.group().rstrip())
+            for m in re.finditer(r"[^\s][^\n]*", story_text)
+        ]
+        if not paragraphs or count <= 0:
+            return []
+
+        count = min(count, len(paragraphs))
+        total = len(story_text)
+        used = set()
+        scenes = []
+
+        for i in range(count):
+            start = total * i / count
+            end = total * (i + 1) / count
+            segment = [p for p in paragraphs if start <= p[0] < end and p[0] not in used]
+            if not segment:
+                # Segment bez wolnego akapitu — weź najbliższy następny wolny, a gdy go brak, poprzedni
+                unused = [p for p in paragraphs if p[0] not in used]
+                segment = [next((p for p in unused if p[0] >= start), unused[-1])]
+
+            offset, text = max(segment, key=self._scene_score)
+            used.add(offset)
+            scenes.append({"text": text, "offset": offset})
+
+        return sorted(scenes, key=lambda scene: scene["offset"])
+
+    def _scene_score(self, paragraph):
+        """Preferuje dłuższe akapity narracyjne zamiast krótkich dialogów"""
+        text = paragraph[1]
+        score = len(text.split())
+        if text[:1] in "-–—\"„":
+            score *= 0.5
+        return score
+
+    def illustrate_scene(self, scene, style):
+        """Generuje ilustrację sceny i zapisuje w niej offset fragmentu źródłowego"""
+        image = self.generate_illustration(scene["text"], style)
+        if image is not None:
+            image.info["scene_offset"] = scene["offset"]
+        return image
+
+    def generate_illustrations(self, scenes, style, max_workers=4):
+        """Generuje ilustracje dla wszystkich scen równolegle (kolejność zachowana)"""
+        if not scenes:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = [pool.submit(self.illustrate_scene, scene, style) for scene in scenes]
+
+            images = []
+            for future in futures:
+                try:
+                    images.append(future.result())
+                except Exception:
+                    images.append(None)
+
+        return images
+
     # ---------------------------------------------------------
     # OKŁADKA — GPT-IMAGE-1 (z bezpieczniejszym promptem)
     # ---------------------------------------------------------
-    def generate_cover(self, sketch, description, style):
+    def generate_cover(self, sketch, description, style, variants=1, fresh=False):
+        """Okładka; przy variants > 1 lista wariantów z jednego zapytania (fresh jak w generate_illustration)"""
+        screening = screen_prompt(description)
+        if screening["blocked"]:
+            return self._as_variants(self._generate_generic_cover(style), variants)
+
         # Skróć i uogólnij opis
-        safe_description = self._sanitize_prompt(description, max_length=150)
+        safe_description = self._sanitize_prompt(screening["text"], max_length=150)
         
         prompt = (
             f"Book cover art in {style.lower()} style. "
@@ -112,216 +588,430 @@ class StoryGenerator:
         )
 
         try:
-            response = self.client.images.generate(
-                model="gpt-image-1",
-                prompt=prompt,
-                size="1024x1024"
-            )
-
-            if not response or not response.data or not response.data[0].b64_json:
-                return None
-
-            image_bytes = base64.b64decode(response.data[0].b64_json)
-            return Image.open(io.BytesIO(image_bytes))
+            return self._generate_variants(prompt, style, variants, screening, fresh=fresh)
         
         except Exception as e:
             # Jeśli nadal blokuje, spróbuj ogólniejszego promptu
             if "moderation" in str(e).lower():
-                return self._generate_generic_cover(style)
+                return self._as_variants(self._generate_generic_cover(style), variants)
             raise e
 
     # ---------------------------------------------------------
     # NAKŁADANIE TYTUŁU NA OKŁADKĘ — POPRAWIONA WERSJA
     # ---------------------------------------------------------
     def add_title_to_cover(self, cover_image, title, author):
-        from PIL import ImageDraw, ImageFont
+        """Nakłada tytuł i autora z gotowej (zapamiętanej) warstwy na kopię okładki"""
+        return compose_title(cover_image, title, author)
 
-        img = cover_image.copy()
-        draw = ImageDraw.Draw(img)
+    def prerender_titles(self, titles, author, cover_size):
+        """Przygotowuje w tle warstwy tytułów, żeby zmiana tytułu była natychmiastowa"""
+        prerender_title_layers(titles, author, cover_size)
 
-        # Załaduj czcionki
-        try:
-            font_title = ImageFont.truetype("fonts/DejaVuSans-Bold.ttf", 90)
-        except:
-            try:
-                font_title = ImageFont.truetype("fonts/DejaVuSans.ttf", 90)
-            except:
-                font_title = ImageFont.load_default()
+    # ---------------------------------------------------------
+    # MODYFIKACJA OPOWIADANIA
+    # ---------------------------------------------------------
+    def modify_story(self, story_text, new_style, new_plot):
+        prompt = (
+            "Zmodyfikuj poniższe opowiadanie zgodnie z instrukcjami.\n"
+            f"Nowy styl: {new_style or 'bez zmian'}.\n"
+            f"Zmiana fabuły: {new_plot or 'bez zmian'}.\n"
+            f"{story_text}"
+        )
 
-        try:
-            font_author = ImageFont.truetype("fonts/DejaVuSans.ttf", 50)
-        except:
-            font_author = ImageFont.load_default()
+        return self._complete("modify", prompt, temperature=0.9)
 
-        W, H = img.size
+    # ---------------------------------------------------------
+    # MODYFIKACJA PRZYROSTOWA — TYLKO DOTKNIĘTE AKAPITY
+    # ---------------------------------------------------------
+    def modify_story_incremental(self, story_text, new_style, new_plot, max_workers=4):
+        """
+        Przepisuje tylko akapity, których dotyczy instrukcja (niezależne fragmenty
+        równolegle) i wstawia je w miejsce oryginałów.
+        Zwraca słownik {"story", "diff", "changed"} — changed to numery akapitów.
+        """
+        paragraphs = [
+            (m.start(), m.end(), m.group().rstrip())
+            for m in re.finditer(r"[^\s][^\n]*", story_text)
+        ]
+        if not paragraphs:
+            return {"story": story_text, "diff": "", "changed": []}
 
-        # ---------------------------------------------------------
-        # TYTUŁ - wycentrowany w górnej części
-        # ---------------------------------------------------------
-        # Jeśli tytuł jest długi, zmniejsz czcionkę
-        if len(title) > 20:
-            try:
-                font_title = ImageFont.truetype("fonts/DejaVuSans-Bold.ttf", 70)
-            except:
-                try:
-                    font_title = ImageFont.truetype("fonts/DejaVuSans.ttf", 70)
-                except:
-                    pass
-
-        # Zawijanie tytułu jeśli jest za długi
-        words = title.split()
-        lines = []
-        current_line = ""
-        
-        for word in words:
-            test_line = word if not current_line else current_line + " " + word
-            bbox = draw.textbbox((0, 0), test_line, font=font_title)
-            w = bbox[2] - bbox[0]
-            
-            if w <= W * 0.9:  # 90% szerokości
-                current_line = test_line
+        selected = self._select_paragraphs(paragraphs, new_style, new_plot)
+        if selected is None:
+            # Nie udało się wskazać akapitów — pełna modyfikacja
+            modified = self.modify_story(story_text, new_style, new_plot)
+            return {
+                "story": modified,
+                "diff": self._story_diff(story_text, modified),
+                "changed": list(range(len(paragraphs)))
+            }
+
+        # Sąsiadujące akapity przepisujemy razem, niezależne grupy — równolegle
+        runs = []
+        for idx in selected:
+            if runs and runs[-1][-1] == idx - 1:
+                runs[-1].append(idx)
             else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = word
-        
-        if current_line:
-            lines.append(current_line)
-
-        # Rysuj tytuł (w górnej części, około 15% wysokości)
-        y_position = H * 0.15
-        line_height = 100
-
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font_title)
-            w = bbox[2] - bbox[0]
-            
-            # Cień dla lepszej czytelności
-            draw.text(
-                ((W - w) / 2 + 3, y_position + 3),
-                line,
-                fill="black",
-                font=font_title
-            )
-            
-            # Właściwy tekst
-            draw.text(
-                ((W - w) / 2, y_position),
-                line,
-                fill="white",
-                font=font_title
-            )
-            
-            y_position += line_height
-
-        # ---------------------------------------------------------
-        # AUTOR - na dole
-        # ---------------------------------------------------------
-        bbox_author = draw.textbbox((0, 0), author, font=font_author)
-        w_author = bbox_author[2] - bbox_author[0]
-
-        # Cień
-        draw.text(
-            ((W - w_author) / 2 + 2, H * 0.88 + 2),
-            author,
-            fill="black",
-            font=font_author
-        )
-        
-        # Właściwy tekst
-        draw.text(
-            ((W - w_author) / 2, H * 0.88),
-            author,
-            fill="white",
-            font=font_author
+                runs.append([idx])
+
+        separator = "\n\n" if "\n\n" in story_text else "\n"
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            rewritten = list(pool.map(
+                lambda run: self._rewrite_run(paragraphs, run, new_style, new_plot, separator),
+                runs
+            ))
+
+        # Wstawianie od końca, żeby pozycje wcześniejszych akapitów się nie przesunęły
+        modified = story_text
+        for run, text in sorted(zip(runs, rewritten), key=lambda item: item[0][0], reverse=True):
+            start = paragraphs[run[0]][0]
+            end = paragraphs[run[-1]][0] + len(paragraphs[run[-1]][2])
+            modified = modified[:start] + text + modified[end:]
+
+        return {
+            "story": modified,
+            "diff": self._story_diff(story_text, modified),
+            "changed": selected
+        }
+
+    def _select_paragraphs(self, paragraphs, new_style, new_plot):
+        """Deterministyczne (temperatura 0) wskazanie akapitów do zmiany"""
+        numbered = "\n".join(f"[{i}] {p[2]}" for i, p in enumerate(paragraphs))
+        prompt = (
+            "Poniżej jest opowiadanie z ponumerowanymi akapitami i instrukcja zmiany.\n"
+            f"Nowy styl: {new_style or 'bez zmian'}.\n"
+            f"Zmiana fabuły: {new_plot or 'bez zmian'}.\n"
+            "Wskaż numery akapitów, które trzeba przepisać, aby wprowadzić zmianę. "
+            "Zmieniaj jak najmniej, ale zachowaj spójność fabuły (także w dalszych akapitach).\n\n"
+            f"{numbered}"
         )
 
-        return img
+        try:
+            raw = self._complete("select_paragraphs", prompt, temperature=0, response_format=PARAGRAPHS_FORMAT)
+            indices = json.loads(raw)["paragraphs"]
+        except (ValueError, KeyError, TypeError, openai.BadRequestError):
+            return None
+
+        selected = sorted({i for i in indices if isinstance(i, int) and 0 <= i < len(paragraphs)})
+        return selected or None
+
+    def _rewrite_run(self, paragraphs, run, new_style, new_plot, separator):
+        before = paragraphs[run[0] - 1][2] if run[0] > 0 else "(początek opowiadania)"
+        after = paragraphs[run[-1] + 1][2] if run[-1] + 1 < len(paragraphs) else "(koniec opowiadania)"
+        fragment = "\n\n".join(paragraphs[i][2] for i in run)
 
-    # ---------------------------------------------------------
-    # MODYFIKACJA OPOWIADANIA
-    # ---------------------------------------------------------
-    def modify_story(self, story_text, new_style, new_plot):
         prompt = (
-            "Zmodyfikuj poniższe opowiadanie zgodnie z instrukcjami.\n"
+            "Przepisz poniższy fragment opowiadania zgodnie z instrukcjami.\n"
             f"Nowy styl: {new_style or 'bez zmian'}.\n"
             f"Zmiana fabuły: {new_plot or 'bez zmian'}.\n"
-            f"{story_text}"
+            "Fragment musi pasować do akapitu poprzedzającego i następującego (nie zmieniaj ich). "
+            "Zwróć tylko przepisany fragment, akapity oddzielone pustą linią.\n\n"
+            f"Akapit poprzedzający:\n{before}\n\n"
+            f"Fragment do przepisania:\n{fragment}\n\n"
+            f"Akapit następujący:\n{after}"
         )
 
-        response = self.client.chat.completions.create(
+        text = self._complete("modify_fragment", prompt, temperature=0.9)
+        return separator.join(p.strip() for p in re.split(r"\n\s*\n", text.strip()) if p.strip())
+
+    def _story_diff(self, old_text, new_text):
+        return "\n".join(difflib.unified_diff(
+            old_text.splitlines(),
+            new_text.splitlines(),
+            fromfile="przed",
+            tofile="po",
+            lineterm=""
+        ))
+
+    # ---------------------------------------------------------
+    # WYWOŁANIA CZATU Z PAMIĘCIĄ PODRĘCZNĄ
+    # ---------------------------------------------------------
+    def _complete(self, kind, prompt, temperature, response_format=None):
+        """Jedno zapytanie do czatu; wynik może pochodzić z pamięci podręcznej"""
+        cached = self._cache_get(kind, prompt, temperature)
+        if cached is not None:
+            return cached
+
+        extra = {"response_format": response_format} if response_format else {}
+        response = self.scheduler.call(
+            "chat",
+            self.client.chat.completions.with_raw_response.create,
             model=self.model,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.9
+            temperature=temperature,
+            **extra
         )
 
-        return response.choices[0].message.content
+        text = response.choices[0].message.content
+        self._cache_set(kind, prompt, temperature, text)
+        return text
+
+    def _use_cache(self, temperature):
+        return self.cache is not None and (temperature == 0 or self.reuse_responses)
+
+    def _cache_get(self, kind, prompt, temperature):
+        if not self._use_cache(temperature):
+            return None
+        return self.cache.get_text(kind, self.model, prompt, temperature)
+
+    def _cache_set(self, kind, prompt, temperature, text):
+        if text and self._use_cache(temperature):
+            self.cache.set_text(kind, self.model, prompt, temperature, text)
     
     # ---------------------------------------------------------
     # POMOCNICZE FUNKCJE BEZPIECZEŃSTWA
     # ---------------------------------------------------------
     def _sanitize_prompt(self, text, max_length=200):
         """Czyści i skraca prompt, aby był bezpieczniejszy"""
-        # Usuń potencjalnie wrażliwe słowa
-        sensitive_words = ['krew', 'śmierć', 'zabić', 'przemoc', 'broń', 'walka']
-        
-        text_lower = text.lower()
-        for word in sensitive_words:
-            if word in text_lower:
-                # Zamień na bardziej neutralne
-                replacements = {
-                    'krew': 'czerwień',
-                    'śmierć': 'koniec',
-                    'zabić': 'pokonać',
-                    'przemoc': 'konflikt',
-                    'broń': 'narzędzie',
-                    'walka': 'pojedynek'
-                }
-                text = text.replace(word, replacements.get(word, ''))
+        # Zamień ryzykowne słowa (wszystkie formy odmiany) na neutralne
+        text = screen_prompt(text)["text"]
         
         # Skróć do max_length znaków
         if len(text) > max_length:
             text = text[:max_length].rsplit(' ', 1)[0] + '...'
         
         return text.strip()
+
+    def _record_moderation(self, prompt, screening, error):
+        """
+        Zapisuje wynik moderacji do strojenia słownika w prompt_screening:
+        brak błędu — przepuszczony, błąd moderacji — zablokowany, inny błąd — bez wpisu.
+        """
+        if error is None:
+            blocked = False
+        elif "moderation" in str(error).lower():
+            blocked = True
+        else:
+            return
+        log = get_screening_log()
+        if log is not None:
+            log.record(prompt, screening, blocked)
     
     def _generate_generic_illustration(self, style):
         """Generuje ogólną ilustrację gdy główny prompt jest zablokowany"""
-        generic_prompts = [
+        return self._first_success(self._generic_illustration_prompts(style), style)
+    
+    def _generate_generic_cover(self, style):
+        """Generuje ogólną okładkę gdy główny prompt jest zablokowany"""
+        return self._first_success(self._generic_cover_prompts(style), style)
+
+    def _generic_illustration_prompts(self, style):
+        return [
             f"A beautiful {style.lower()} landscape with trees and sky",
             f"An artistic {style.lower()} scene with nature and light",
             f"A peaceful {style.lower()} illustration of a magical forest"
         ]
-        
-        for prompt in generic_prompts:
-            try:
-                response = self.client.images.generate(
-                    model="gpt-image-1",
-                    prompt=prompt,
-                    size="1024x1024"
-                )
-                if response and response.data and response.data[0].b64_json:
-                    image_bytes = base64.b64decode(response.data[0].b64_json)
-                    return Image.open(io.BytesIO(image_bytes))
-            except:
-                continue
-        
-        return None
-    
-    def _generate_generic_cover(self, style):
-        """Generuje ogólną okładkę gdy główny prompt jest zablokowany"""
-        prompt = f"Beautiful book cover art in {style.lower()} style, magical and artistic"
-        
+
+    def _generic_cover_prompts(self, style):
+        return [
+            f"Beautiful book cover art in {style.lower()} style, magical and artistic",
+            f"Enchanting {style.lower()} style book cover with a glowing sky and distant hills",
+            f"Whimsical {style.lower()} style book cover with stars, clouds and soft light"
+        ]
+
+    # ---------------------------------------------------------
+    # ZABEZPIECZENIE RÓWNOLEGŁYMI ZAPYTANIAMI (HEDGING)
+    # ---------------------------------------------------------
+    def _first_success(self, prompts, style, max_parallel=3):
+        """Wysyła prompty jednocześnie i zwraca pierwszy udany obraz; resztę pomija"""
+        # Prompty zastępcze są stałe — zwykle któryś jest już w pamięci podręcznej
+        if self.image_cache is not None:
+            for prompt in prompts:
+                if self.image_cache.get_bytes(prompt, style, "1024x1024", "gpt-image-1", self._image_options()) is not None:
+                    return self._generate_image(prompt, style)
+
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(prompts))))
+        futures = [pool.submit(self._generate_image, prompt, style) for prompt in prompts]
+        try:
+            for future in as_completed(futures):
+                try:
+                    image = future.result()
+                except Exception:
+                    continue
+                if image is not None:
+                    return image
+            return None
+        finally:
+            # Nierozpoczęte zapytania anulujemy, trwających nie czekamy
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def _generate_variants(self, prompt, style, variants, screening, fresh=False):
+        """
+        Pojedynczy obraz (z hedgingiem) albo lista wariantów z jednego zapytania.
+        Wynik moderacji zapisywany jest według głównego zapytania.
+        """
+        if variants <= 1:
+            return self._generate_hedged(prompt, style, screening, fresh=fresh)
+        return self._moderated(prompt, screening, self._generate_images, prompt, style, variants, fresh=fresh)
+
+    def _moderated(self, prompt, screening, func, *args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record_moderation(prompt, screening, e)
+            raise
+        self._record_moderation(prompt, screening, None)
+        return result
+
+    def _as_variants(self, image, variants):
+        """Obraz zastępczy w kształcie wyniku oczekiwanym przez wywołującego"""
+        if variants <= 1:
+            return image
+        return [image] if image is not None else []
+
+    def _generate_hedged(self, prompt, style, screening, fresh=False):
+        """
+        Główny prompt; jeśli odpowiedź spóźnia się ponad percentyl HEDGE_PERCENTILE
+        dotychczasowych czasów, startuje równolegle drugie zapytanie z tym samym promptem
+        i wygrywa pierwszy udany obraz. Moderację zapisuje wynik głównego zapytania
+        (także gdy kończy się już po zwróceniu obrazu). Błąd obu zapytań jest zgłaszany dalej.
+        """
+        threshold = _image_latencies.percentile(HEDGE_PERCENTILE) if self.hedge_images else None
+        if threshold is None:
+            return self._moderated(prompt, screening, self._generate_image, prompt, style, fresh=fresh)
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        primary = pool.submit(self._generate_image, prompt, style, fresh=fresh)
+        primary.add_done_callback(lambda f: self._record_moderation(prompt, screening, f.exception()))
         try:
-            response = self.client.images.generate(
-                model="gpt-image-1",
+            done, _ = wait([primary], timeout=threshold)
+            if done:
+                return primary.result()
+
+            hedge = pool.submit(self._generate_image, prompt, style, fresh=fresh)
+            primary_error = None
+            for future in as_completed([primary, hedge]):
+                try:
+                    image = future.result()
+                except Exception as e:
+                    if future is primary:
+                        primary_error = e
+                    continue
+                if image is not None:
+                    return image
+
+            if primary_error is not None:
+                raise primary_error
+            return None
+        finally:
+            pool.shutdown(wait=False)
+
+    # ---------------------------------------------------------
+    # GENEROWANIE OBRAZU Z PAMIĘCIĄ PODRĘCZNĄ
+    # ---------------------------------------------------------
+    def _generate_image(self, prompt, style, size="1024x1024", model="gpt-image-1", quality=None, fresh=False,
+                        source=None):
+        """Zwraca obraz z pamięci podręcznej albo generuje go i zapamiętuje bajty"""
+        images = self._generate_images(prompt, style, 1, size=size, model=model, quality=quality, fresh=fresh,
+                                       source=source)
+        return images[0] if images else None
+
+    def _generate_images(self, prompt, style, n, size="1024x1024", model="gpt-image-1", quality=None,
+                         fresh=False, source=None):
+        """
+        Zwraca n wariantów obrazu z jednego zapytania (parametr n API).
+        Każdy wariant ma własny wpis w pamięci podręcznej; wariant 0 dzieli
+        klucz z pojedynczym obrazem dla tego samego promptu.
+        fresh=True pomija odczyt z pamięci — nowe obrazy zastępują zapamiętane.
+        source — skrót obrazu źródłowego (np. szkicu) dołączany do klucza pamięci.
+        """
+        options = self._image_options(quality)
+        key_options = dict(options, source=source) if source else options
+        variant_options = [key_options] + [dict(key_options, variant=i) for i in range(1, n)]
+
+        cached = []
+        if self.image_cache is not None and not fresh:
+            for opts in variant_options:
+                image_bytes = self.image_cache.get_bytes(prompt, style, size, model, opts)
+                if image_bytes is None:
+                    break
+                cached.append(image_bytes)
+
+        if len(cached) == n:
+            encoded = cached
+        else:
+            started = time.monotonic()
+            response = self.scheduler.call(
+                "images",
+                self.client.images.with_raw_response.generate,
+                model=model,
                 prompt=prompt,
-                size="1024x1024"
+                size=size,
+                n=n,
+                **options
             )
-            if response and response.data and response.data[0].b64_json:
-                image_bytes = base64.b64decode(response.data[0].b64_json)
-                return Image.open(io.BytesIO(image_bytes))
-        except:
-            pass
-        
-        return None
\ No newline at end of file
+
+            if not response or not response.data:
+                return []
+
+            encoded = [base64.b64decode(item.b64_json) for item in response.data if item.b64_json]
+            if not encoded:
+                return []
+
+            # Czas zapytania o wiele wariantów nie jest miarodajny dla hedgingu
+            if n == 1:
+                _image_latencies.add(time.monotonic() - started)
+            if self.image_cache is not None:
+                for opts, image_bytes in zip(variant_options, encoded):
+                    self.image_cache.set_bytes(prompt, style, size, model, image_bytes, opts)
+
+        images = []
+        for image_bytes in encoded:
+            # Image.open czyta tylko nagłówek — piksele dekodowane są przy pierwszym użyciu
+            image = Image.open(io.BytesIO(image_bytes))
+            # Skompresowane bajty z API są źródłem prawdy — eksport używa ich bez ponownego kodowania
+            attach_encoded(image, image_bytes, options["output_format"])
+            # Prompt zostaje przy obrazie, żeby wersja finalna powstała z tego samego opisu
+            image.info.update(prompt=prompt, style=style, quality=options["quality"])
+            images.append(image)
+        return images
+
+    def _image_options(self, quality=None):
+        """Parametry wyjścia obrazu: jakość, format i stopień kompresji"""
+        options = {
+            "quality": quality or self.image_quality,
+            "output_format": self.image_format
+        }
+        if self.image_format in ("jpeg", "webp"):
+            options["output_compression"] = self.image_compression
+        return options
+
+    # ---------------------------------------------------------
+    # SZKICE I WERSJE FINALNE
+    # ---------------------------------------------------------
+    def is_draft(self, image):
+        return image is not None and image.info.get("quality") == DRAFT_QUALITY
+
+    def render_final(self, image):
+        """Renderuje szkic ponownie w pełnej jakości z tym samym promptem"""
+        if not self.is_draft(image):
+            return image
+
+        # Wersja finalna jest zapamiętana dla konkretnego szkicu — warianty tego samego
+        # promptu (i szkice wygenerowane ponownie) dostają osobne wersje finalne
+        draft = encoded_bytes(image, encoded_format(image) or "JPEG")
+        final = self._generate_image(
+            image.info["prompt"], image.info["style"], quality=FINAL_QUALITY,
+            source=hashlib.sha256(draft).hexdigest()[:16]
+        )
+        if final is None:
+            return image
+        if "scene_offset" in image.info:
+            final.info["scene_offset"] = image.info["scene_offset"]
+        return final
+
+    def finalize_images(self, images, max_workers=4):
+        """Wersje finalne dla listy obrazów (równolegle, kolejność zachowana)"""
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = [pool.submit(self.render_final, image) for image in images]
+
+            finals = []
+            for image, future in zip(images, futures):
+                try:
+                    finals.append(future.result())
+                except Exception:
+                    # Nie udało się — zostaje szkic
+                    finals.append(image)
+        return finals
\ No newline at end of file
@@ -0,0 +1,199 @@
+import threading
+from functools import lru_cache
+
+from PIL import ImageFont
+from reportlab.pdfbase import pdfmetrics
+
+from font_registry import get_font_registry
+
+# Odmiany czcionek z font_registry
+TITLE_FONT = "bold"
+BODY_FONT = "regular"
+
+# Rozmiar, przy którym mierzymy znaki — szerokości dla innych rozmiarów skalujemy liniowo
+REFERENCE_SIZE = 1000
+
+_measurers = {}
+_measurers_lock = threading.Lock()
+
+
+# -----------------------------
+# CZCIONKI PIL (LRU)
+# -----------------------------
+@lru_cache(maxsize=64)
+def _truetype(path, size):
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=16)
+def _default_font(size):
+    return ImageFont.load_default(size)
+
+
+def load_font(variant, size):
+    """Czcionka PIL danej odmiany w danym rozmiarze, z pamięci podręcznej"""
+    path = get_font_registry().path(variant)
+    if path is None:
+        return _default_font(size)
+    return _truetype(path, size)
+
+
+# -----------------------------
+# POMIAR TEKSTU
+# -----------------------------
+class TextMeasurer:
+    """
+    Szerokość tekstu z pamięcią podręczną szerokości znaków i całych słów.
+    Szerokości trzymamy dla rozmiaru 1 — dla innych rozmiarów mnożymy
+    (pomijamy kerning, co przy doborze rozmiaru i zawijaniu nie ma znaczenia).
+    """
+
+    # Limit zapamiętanych słów na czcionkę (antologie mają kilkadziesiąt tysięcy form)
+    MAX_WORDS = 100000
+
+    def __init__(self, advance_func):
+        self._advance_func = advance_func
+        self._advances = {}
+        self._words = {}
+
+    def advance(self, char):
+        value = self._advances.get(char)
+        if value is None:
+            value = self._advance_func(char)
+            self._advances[char] = value
+        return value
+
+    def word_units(self, word):
+        """Szerokość słowa dla rozmiaru 1 — każde słowo mierzone tylko raz"""
+        value = self._words.get(word)
+        if value is None:
+            value = sum(self.advance(char) for char in word)
+            if len(self._words) >= self.MAX_WORDS:
+                self._words.clear()
+            self._words[word] = value
+        return value
+
+    def width(self, text, size):
+        return sum(self.advance(char) for char in text) * size
+
+
+def pil_measurer(variant):
+    """Pomiar dla czcionek PIL (okładki)"""
+    key = ("pil", get_font_registry().path(variant))
+    with _measurers_lock:
+        if key not in _measurers:
+            font = load_font(variant, REFERENCE_SIZE)
+            _measurers[key] = TextMeasurer(lambda char: font.getlength(char) / REFERENCE_SIZE)
+        return _measurers[key]
+
+
+def reportlab_measurer(font_name):
+    """Pomiar dla czcionek zarejestrowanych w ReportLab (PDF)"""
+    key = ("reportlab", font_name)
+    with _measurers_lock:
+        if key not in _measurers:
+            _measurers[key] = TextMeasurer(lambda char: pdfmetrics.stringWidth(char, font_name, 1))
+        return _measurers[key]
+
+
+# -----------------------------
+# ZAWIJANIE I DOPASOWANIE DO RAMKI
+# -----------------------------
+def wrap_words(text, measurer, size, max_width):
+    """
+    Zawijanie zachłanne w jednym przebiegu — szerokość każdego słowa z pamięci
+    podręcznej, szerokość linii sumowana narastająco.
+    Zwraca (linie, szerokość najszerszej linii).
+    """
+    space = measurer.advance(" ") * size
+    lines = []
+    widest = 0
+    current = []
+    current_width = 0
+
+    for word in text.split():
+        word_width = measurer.word_units(word) * size
+        if current and current_width + space + word_width > max_width:
+            lines.append(" ".join(current))
+            widest = max(widest, current_width)
+            current = [word]
+            current_width = word_width
+        else:
+            current_width = current_width + space + word_width if current else word_width
+            current.append(word)
+
+    if current:
+        lines.append(" ".join(current))
+        widest = max(widest, current_width)
+
+    return lines, widest
+
+
+def wrap_optimal(text, measurer, size, max_width):
+    """
+    Łamanie „total-fit” (Knuth–Plass bez dzielenia wyrazów, tekst do lewej):
+    minimalizuje sumę kwadratów wolnego miejsca we wszystkich liniach poza ostatnią,
+    dzięki czemu prawa krawędź jest równiejsza. Zwraca listę linii.
+    """
+    words = text.split()
+    if not words:
+        return []
+
+    space = measurer.advance(" ") * size
+    widths = [measurer.word_units(word) * size for word in words]
+    n = len(words)
+    cost = [0.0] + [float("inf")] * n
+    start = [0] * (n + 1)
+
+    # cost[j] — najmniejszy koszt ułożenia słów 0..j-1; start[j] — pierwsze słowo ostatniej linii
+    for j in range(1, n + 1):
+        line_width = -space
+        for i in range(j - 1, -1, -1):
+            line_width += widths[i] + space
+            if line_width > max_width and i < j - 1:
+                break
+            # Ostatnia linia akapitu i pojedyncze za długie słowo nie są karane
+            slack = max(0.0, max_width - line_width)
+            badness = 0.0 if j == n else slack * slack
+            if cost[i] + badness < cost[j]:
+                cost[j] = cost[i] + badness
+                start[j] = i
+
+    lines = []
+    j = n
+    while j > 0:
+        i = start[j]
+        lines.append(" ".join(words[i:j]))
+        j = i
+    lines.reverse()
+    return lines
+
+
+def fit_text(text, measurer, box_width, box_height, min_size=10, max_size=120, line_spacing=1.15):
+    """
+    Największy rozmiar (wyszukiwanie binarne), przy którym zawinięty tekst mieści się
+    w ramce box_width × box_height. Zwraca słownik: size, lines, line_height.
+    """
+    def layout(size):
+        lines, widest = wrap_words(text, measurer, size, box_width)
+        line_height = size * line_spacing
+        fits = widest <= box_width and len(lines) * line_height <= box_height
+        return fits, lines, line_height
+
+    best = None
+    low, high = min_size, max_size
+    while low <= high:
+        size = (low + high) // 2
+        fits, lines, line_height = layout(size)
+        if fits:
+            best = {"size": size, "lines": lines, "line_height": line_height}
+            low = size + 1
+        else:
+            high = size - 1
+
+    if best is None:
+        # Nawet najmniejszy rozmiar się nie mieści — zostaje minimalny
+        _, lines, line_height = layout(min_size)
+        best = {"size": min_size, "lines": lines, "line_height": line_height}
+
+    return best
@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops, ImageDraw
+
+from text_layout import BODY_FONT, TITLE_FONT, fit_text, load_font, pil_measurer
+
+# Ile gotowych warstw trzymamy w pamięci (warstwa jest przycięta do napisów, ~1 MB)
+MAX_LAYERS = 32
+
+_layers = OrderedDict()
+_pending = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="title-layers")
+
+
+# -----------------------------
+# SKŁADANIE OKŁADKI
+# -----------------------------
+def compose_title(cover_image, title, author):
+    """Okładka z tytułem: gotowa warstwa RGBA nałożona na kopię czystej okładki"""
+    layer, offset = get_title_layer(title, author, cover_image.size)
+
+    img = cover_image.convert("RGB") if cover_image.mode != "RGB" else cover_image.copy()
+    if layer is not None:
+        img.paste(layer, offset, layer)
+    return img
+
+
+def get_title_layer(title, author, size):
+    """
+    Warstwa (obraz RGBA, przesunięcie) dla (tytuł, autor, rozmiar okładki) —
+    z pamięci, z trwającego renderowania w tle albo renderowana od razu.
+    """
+    key = (title, author, tuple(size))
+    with _lock:
+        if key in _layers:
+            _layers.move_to_end(key)
+            return _layers[key]
+        future = _pending.get(key)
+
+    if future is not None:
+        return future.result()
+    return _store(key, render_title_layer(title, author, size))
+
+
+def prerender_title_layers(titles, author, size):
+    """Renderuje w tle warstwy dla wszystkich propozycji tytułów"""
+    for title in titles:
+        key = (title, author, tuple(size))
+        with _lock:
+            if key in _layers or key in _pending:
+                continue
+            _pending[key] = _executor.submit(_render_pending, key)
+
+
+def _render_pending(key):
+    title, author, size = key
+    try:
+        return _store(key, render_title_layer(title, author, size))
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+
+
+def _store(key, layer):
+    with _lock:
+        _layers[key] = layer
+        _layers.move_to_end(key)
+        while len(_layers) > MAX_LAYERS:
+            _layers.popitem(last=False)
+    return layer
+
+
+# -----------------------------
+# RENDEROWANIE WARSTWY
+# -----------------------------
+def render_title_layer(title, author, size):
+    """
+    Rysuje tytuł i autora (biały tekst z czarnym cieniem) na przezroczystej warstwie.
+    Zwraca (warstwa RGBA przycięta do napisów, przesunięcie) albo (None, None).
+    """
+    W, H = size
+    text_mask = Image.new("L", (W, H), 0)
+    shadow_mask = Image.new("L", (W, H), 0)
+    draw_text = ImageDraw.Draw(text_mask)
+    draw_shadow = ImageDraw.Draw(shadow_mask)
+
+    def draw(position, text, font, offset):
+        x, y = position
+        draw_shadow.text((x + offset, y + offset), text, fill=255, font=font)
+        draw_text.text((x, y), text, fill=255, font=font)
+
+    # ---------------------------------------------------------
+    # TYTUŁ - największy rozmiar mieszczący się w górnej części
+    # ---------------------------------------------------------
+    title_measurer = pil_measurer(TITLE_FONT)
+    title_layout = fit_text(
+        title, title_measurer,
+        box_width=W * 0.9, box_height=H * 0.3,
+        min_size=30, max_size=90
+    )
+    font_title = load_font(TITLE_FONT, title_layout["size"])
+
+    # Tytuł w górnej części, około 15% wysokości
+    y_position = H * 0.15
+    for line in title_layout["lines"]:
+        w = title_measurer.width(line, title_layout["size"])
+        draw(((W - w) / 2, y_position), line, font_title, offset=3)
+        y_position += title_layout["line_height"]
+
+    # ---------------------------------------------------------
+    # AUTOR - na dole; długi podpis zawinięty (bez wychodzenia poza okładkę)
+    # ---------------------------------------------------------
+    if author:
+        author_measurer = pil_measurer(BODY_FONT)
+        author_layout = fit_text(
+            author, author_measurer,
+            box_width=W * 0.9, box_height=50 * 1.15,
+            min_size=16, max_size=50
+        )
+        font_author = load_font(BODY_FONT, author_layout["size"])
+        # Linie od 88% wysokości; gdy jest ich dużo, blok podnosimy, żeby nie wyszedł poza dół
+        y_position = min(H * 0.88, H * 0.97 - len(author_layout["lines"]) * author_layout["line_height"])
+        for line in author_layout["lines"]:
+            w = author_measurer.width(line, author_layout["size"])
+            draw(((W - w) / 2, y_position), line, font_author, offset=2)
+            y_position += author_layout["line_height"]
+
+    # Biały tekst nad czarnym cieniem: kolor (z premnożoną alfą) = maska tekstu,
+    # alfa = suma masek tekstu i cienia
+    alpha = ImageChops.screen(text_mask, shadow_mask)
+    bbox = alpha.getbbox()
+    if bbox is None:
+        return None, None
+
+    layer = Image.merge("RGBa", (text_mask, text_mask, text_mask, alpha)).convert("RGBA")
+    return layer.crop(bbox), bbox[:2]